@@ -0,0 +1,144 @@
+"""Local File System caches"""
+__doc__="""Local File System caches"""
+
+import os
+from collections import OrderedDict
+from threading import Lock
+
+_marker = []
+
+
+class LRUCache:
+    """ Bounded, thread-safe least recently used mapping """
+
+    def __init__(self, maxsize=100):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, default=None, check=None):
+        """Return the value cached for 'key' or 'default'.
+        If 'check' is given it is called with the cached value, and a
+        value for which it returns false is dropped and counted as a miss."""
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if check is not None and not check(value):
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            self._shrink()
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def resize(self, maxsize):
+        with self._lock:
+            self.maxsize = maxsize
+            self._shrink()
+
+    def _shrink(self):
+        # Caller must hold the lock
+        while len(self._data) > max(self.maxsize, 0):
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def info(self):
+        """Return a mapping of cache statistics."""
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+class StatMemo:
+    """ Memo of the os.stat results of paths for the duration of one
+    request. Failed stats are memoized too and raised again. """
+
+    def __init__(self):
+        self._stats = {}
+        self.calls = self.hits = 0
+
+    def stat(self, path):
+        """Return os.stat(path), calling os.stat at most once per path."""
+        try:
+            st = self._stats[path]
+        except KeyError:
+            self.calls += 1
+            try:
+                st = os.stat(path)
+            except OSError as err:
+                st = (err.errno, err.strerror)
+            self._stats[path] = st
+        else:
+            self.hits += 1
+        if type(st) is tuple:
+            raise OSError(st[0], st[1], path)
+        return st
+
+    def prime(self, path, st):
+        """Record 'st' as the stat result of 'path'."""
+        self._stats[path] = st
+
+    def invalidate(self, path=None):
+        """Forget the stat result of 'path', or all results."""
+        if path is None:
+            self._stats.clear()
+        else:
+            self._stats.pop(path, None)
+
+    def info(self):
+        """Return a mapping of memo statistics."""
+        return {
+            'size': len(self._stats),
+            'calls': self.calls,
+            'hits': self.hits,
+        }
+
+
+# Caches are shared by all threads and all directory objects of one
+# LocalFS, so they live at module level and are looked up by name and
+# by the base path of the owning LocalFS.
+_caches = {}
+_caches_lock = Lock()
+
+def getCache(name, owner, maxsize):
+    """Return the cache 'name' of 'owner', created or resized to 'maxsize'."""
+    key = (name, owner)
+    cache = _caches.get(key)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(key)
+            if cache is None:
+                cache = _caches[key] = LRUCache(maxsize)
+    if cache.maxsize != maxsize:
+        cache.resize(maxsize)
+    return cache
@@ -0,0 +1,238 @@
+"""Local File System metadata index"""
+__doc__="""Local File System metadata index"""
+
+import sqlite3
+from threading import Lock, local
+
+############################################################################
+# The metadata index is a SQLite database with a row for every file and
+# directory below the base path of a LocalFS. Paths are stored relative
+# to the base path with '/' as separator, the base path itself is ''.
+# For each indexed directory the mtime and ctime it had when it was
+# indexed are stored, so the index of a directory is known to be fresh
+# while they are unchanged.
+#
+# The database uses WAL journaling, so readers are not blocked while a
+# directory is reindexed. Each thread uses its own connection.
+############################################################################
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS dirs (
+    dir TEXT PRIMARY KEY,
+    mtime_ns INTEGER,
+    ctime_ns INTEGER
+);
+CREATE TABLE IF NOT EXISTS files (
+    dir TEXT NOT NULL,
+    name TEXT NOT NULL,
+    is_dir INTEGER NOT NULL,
+    size INTEGER,
+    mtime REAL,
+    content_type TEXT,
+    meta_type TEXT,
+    PRIMARY KEY (dir, name)
+);
+CREATE INDEX IF NOT EXISTS files_content_type ON files (content_type);
+CREATE INDEX IF NOT EXISTS files_meta_type ON files (meta_type);
+CREATE INDEX IF NOT EXISTS files_size ON files (size);
+CREATE INDEX IF NOT EXISTS files_mtime ON files (mtime);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+_columns = ('dir', 'name', 'is_dir', 'size', 'mtime', 'content_type',
+    'meta_type')
+
+_sort_columns = {
+    'path': 'dir, name',
+    'name': 'name, dir',
+    'size': 'size, dir, name',
+    'mtime': 'mtime, dir, name',
+    'content_type': 'content_type, dir, name',
+    'meta_type': 'meta_type, dir, name',
+}
+
+def _subtree(column, dir):
+    # The condition for the rows below 'dir'. '0' follows '/' in the
+    # collating sequence, which avoids GLOB and LIKE special characters.
+    if not dir:
+        return '1', ()
+    return ('(%s = ? OR (%s >= ? AND %s < ?))' % (column, column, column),
+            (dir, dir + '/', dir + '0'))
+
+
+class MetadataIndex:
+    """ SQLite index of the files below a directory """
+
+    def __init__(self, dbpath):
+        self.dbpath = dbpath
+        self._local = local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.dbpath, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(_schema)
+            self._local.conn = conn
+        return conn
+
+    def getMeta(self, key, default=None):
+        """Return the index setting 'key'."""
+        row = self._connection().execute(
+            'SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return default
+        return row[0]
+
+    def setMeta(self, key, value):
+        """Set the index setting 'key'."""
+        conn = self._connection()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                (key, value))
+
+    def clear(self):
+        """Remove all files and directories from the index."""
+        conn = self._connection()
+        with conn:
+            conn.execute('DELETE FROM files')
+            conn.execute('DELETE FROM dirs')
+
+    def dirState(self, dir):
+        """Return the (mtime_ns, ctime_ns) of the directory 'dir' when it
+        was indexed, or None if it is not indexed."""
+        row = self._connection().execute(
+            'SELECT mtime_ns, ctime_ns FROM dirs WHERE dir = ?',
+            (dir,)).fetchone()
+        if row is None:
+            return None
+        return tuple(row)
+
+    def dirRows(self, dir):
+        """Return a mapping of the names in the directory 'dir' to
+        (is_dir, size, mtime, content_type, meta_type) tuples."""
+        r = {}
+        for row in self._connection().execute(
+                'SELECT name, is_dir, size, mtime, content_type, meta_type '
+                'FROM files WHERE dir = ?', (dir,)):
+            r[row[0]] = tuple(row[1:])
+        return r
+
+    def updateDir(self, dir, state, rows):
+        """Replace the index of the directory 'dir'. 'rows' is a list of
+        (name, is_dir, size, mtime, content_type, meta_type) tuples.
+        Subdirectories that no longer exist are removed with their
+        contents."""
+        conn = self._connection()
+        names = set([row[0] for row in rows])
+        with conn:
+            old = conn.execute(
+                'SELECT name, is_dir FROM files WHERE dir = ?',
+                (dir,)).fetchall()
+            prefix = dir and dir + '/' or ''
+            for name, is_dir in old:
+                if name in names:
+                    continue
+                conn.execute('DELETE FROM files WHERE dir = ? AND name = ?',
+                    (dir, name))
+                if is_dir:
+                    self._deleteTree(conn, prefix + name)
+            conn.executemany(
+                'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(dir,) + tuple(row) for row in rows])
+            conn.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)',
+                (dir,) + tuple(state))
+
+    def removeTree(self, dir):
+        """Remove the directory 'dir' and its contents from the index."""
+        conn = self._connection()
+        with conn:
+            self._deleteTree(conn, dir)
+
+    def _deleteTree(self, conn, dir):
+        cond, args = _subtree('dir', dir)
+        conn.execute('DELETE FROM files WHERE ' + cond, args)
+        conn.execute('DELETE FROM dirs WHERE ' + cond, args)
+
+    def query(self, dir='', name=None, content_type=None, meta_type=None,
+              is_dir=None, min_size=None, max_size=None, newer=None,
+              older=None, sort_on='path', reverse=0, limit=None, 
+              filter=None):
+        """Return a list of mappings with the keys of _columns for the
+        files below the directory 'dir' that match all given criteria.
+        'name' and 'content_type' are glob patterns, 'meta_type' is a
+        string or a list of strings. If 'filter' is given, only the 
+        mappings for which it returns true are included; 'limit' counts
+        the included mappings."""
+        where, args = [], []
+        cond, a = _subtree('dir', dir)
+        where.append(cond)
+        args.extend(a)
+        if name is not None:
+            where.append('name GLOB ?')
+            args.append(name)
+        if content_type is not None:
+            where.append('content_type GLOB ?')
+            args.append(content_type)
+        if meta_type is not None:
+            if isinstance(meta_type, str):
+                meta_type = [meta_type]
+            where.append('meta_type IN (%s)' % ','.join('?' * len(meta_type)))
+            args.extend(meta_type)
+        if is_dir is not None:
+            where.append('is_dir = ?')
+            args.append(is_dir and 1 or 0)
+        if min_size is not None:
+            where.append('size >= ?')
+            args.append(min_size)
+        if max_size is not None:
+            where.append('size <= ?')
+            args.append(max_size)
+        if newer is not None:
+            where.append('mtime > ?')
+            args.append(newer)
+        if older is not None:
+            where.append('mtime < ?')
+            args.append(older)
+        try:
+            order = _sort_columns[sort_on]
+        except KeyError:
+            raise ValueError('Cannot sort on %s' % repr(sort_on))
+        if reverse:
+            order = ', '.join([c + ' DESC' for c in order.split(', ')])
+        sql = 'SELECT %s FROM files WHERE %s ORDER BY %s' % (
+            ', '.join(_columns), ' AND '.join(where), order)
+        if filter is None:
+            if limit is not None:
+                sql = sql + ' LIMIT %d' % int(limit)
+            return [dict(zip(_columns, row))
+                    for row in self._connection().execute(sql, args)]
+        # The rows are filtered as they are read, up to the limit
+        r = []
+        if limit is not None and limit <= 0:
+            return r
+        for row in self._connection().execute(sql, args):
+            row = dict(zip(_columns, row))
+            if filter(row):
+                r.append(row)
+                if limit is not None and len(r) >= limit:
+                    break
+        return r
+
+
+_indexes = {}
+_indexes_lock = Lock()
+
+def getIndex(dbpath):
+    """Return the metadata index stored in the file 'dbpath'."""
+    index = _indexes.get(dbpath)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.get(dbpath)
+            if index is None:
+                index = _indexes[dbpath] = MetadataIndex(dbpath)
+    return index
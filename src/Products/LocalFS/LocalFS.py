@@ -41,7 +41,11 @@
 __version__='2.0'
 __doc__="""Local File System product"""
 
-import sys, os, re, stat, glob as errno, time, tempfile
+import sys, os, re, stat, errno, fnmatch, mimetypes, time, tempfile, heapq
+import json, zlib, logging, uuid, shutil
+from collections import namedtuple
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import quote
 import App, Acquisition, Persistence, OFS
 import AccessControl
@@ -75,7 +79,9 @@ eNotFound=MessageDialog(
           action ='manage_main',)
 
 from ZODB.TimeStamp import TimeStamp
+from ZODB.POSException import ConflictError
 from DateTime import DateTime
+from DateTime.interfaces import DateTimeError
 import marshal  # sbk
 from ZPublisher import xmlrpc
 try: 
@@ -86,6 +92,26 @@ except ImportError:
 from zExceptions import BadRequest, Forbidden, Unauthorized, NotFound, MethodNotAllowed
 from Products.PageTemplates.ZopePageTemplate import ZopePageTemplate
 from Products.PythonScripts.PythonScript import PythonScript
+from Products.LocalFS.Cache import getCache, LRUCache, StatMemo
+from Products.LocalFS.Index import getIndex
+from Products.LocalFS.Upload import getStaging
+from Products.LocalFS.StreamingFile import StreamingFile, StreamingImage, Sdata
+from Products.LocalFS.StreamingFile import LocalPath
+from Products.LocalFS.StreamingFile import stat_etag, not_modified
+from App.Common import rfc1123_date
+from zope.interface import implementer
+from ZPublisher.Iterators import IUnboundStreamIterator
+try:
+    from zope.globalrequest import getRequest
+except ImportError:
+    def getRequest(): return None
+try:
+    from AccessControl.class_init import InitializeClass
+except ImportError:
+    # Zope <=2.12
+    from App.class_init import InitializeClass
+
+LOG = logging.getLogger('LocalFS')
 
 class UploadError(Exception): pass
 class RenameError(Exception): pass
@@ -99,7 +125,12 @@ if (_iswin32):
         pass
     unc_expr = re.compile(r'(\\\\[^\\]+\\[^\\]+)(.*)')
 
-_test_read = 1024 * 8
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+_sniff_read = 1024
 _unknown = '(unknown)'
 
 ############################################################################
@@ -108,33 +139,133 @@ _unknown = '(unknown)'
 #
 # 1. Call _get_content_type which tries to look up the content-type 
 #    in the type map based on the file extension.
-# 2. If that fails then create a file object with the first _test_read
-#    bytes of data and see what content-type Zope determines.
+# 2. If that fails then _guess_content_type guesses the content-type
+#    from the file name, and if that fails too, _sniff reads the first
+#    _sniff_read bytes of the file and matches them against the
+#    signatures of well known formats. If nothing matches the data is
+#    classified as 'text/plain' or 'application/octet-stream'. 
 #    If we can't read the file then assign 'application/octet-stream'.
-# 3. If we found a content-type then assign it to the object in
-#    _set_content_type. This overrides the type assigned by Zope.
-# 4. Try to see if Zope has assigned 'text/html' to a file that it
-#    shouldn't have and change the type back to 'text/plain'. This
-#    also happens in _set_content_type.
+# 3. Files named like HTML files are changed to 'text/plain' unless
+#    their data starts like an HTML document.
+# 4. _set_content_type assigns the content-type to the object. This 
+#    overrides the type assigned by Zope.
+#
+# The result of _sniff is memoized per inode and modification time, so
+# a file is read at most once until it changes.
 ############################################################################
 
-def _get_content_type(ext, _type_map):
-    """_get_content_type"""
+def _get_content_type(name, _type_map):
+    """Return the (content_type, class) type map entry of the extension
+    of the file 'name', or (None, None). The extension is looked up in
+    lower case, as it is when the object of the file is created."""
+    ext = os.path.splitext(name)[-1].lower()
     try: 
         return _type_map[ext]
     except KeyError:
         return (None, None)
 
-def _set_content_type(ob, content_type, data):
+def _set_content_type(ob, content_type, path, entry=None):
     """_set_content_type"""
-    if content_type:
-        ob.content_type = content_type
-    if getattr(ob, 'content_type', None) == 'text/html':
-        if content_type == 'text/html':
-            return
-        data = data.strip().lower()
-        if data[:6] != '<html>' and data[:14] != '<!doctype html':
-            ob.content_type = 'text/plain'
+    if not content_type:
+        content_type = _guess_content_type(
+            os.path.basename(path), path, entry)
+    ob.content_type = content_type
+
+def _guess_content_type(name, path, entry=None):
+    """Return the content-type of a file without a type map entry."""
+    content_type = mimetypes.guess_type(name)[0]
+    if content_type is None:
+        return _sniff(path, entry)
+    if content_type == 'text/html' and _sniff(path, entry) != 'text/html':
+        return 'text/plain'
+    return content_type
+
+# Signatures at the start of the data
+_magic = (
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'II*\x00', 'image/tiff'),
+    (b'MM\x00*', 'image/tiff'),
+    (b'%PDF-', 'application/pdf'),
+    (b'%!PS', 'application/postscript'),
+    (b'PK\x03\x04', 'application/zip'),
+    (b'\x1f\x8b', 'application/x-gzip'),
+    (b'BZh', 'application/x-bzip2'),
+    (b'\xfd7zXZ\x00', 'application/x-xz'),
+    (b'7z\xbc\xaf\x27\x1c', 'application/x-7z-compressed'),
+    (b'{\\rtf', 'application/rtf'),
+    (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'application/msword'),
+    (b'\x7fELF', 'application/octet-stream'),
+    (b'ID3', 'audio/mpeg'),
+    (b'OggS', 'application/ogg'),
+    (b'fLaC', 'audio/flac'),
+    (b'FWS', 'application/x-shockwave-flash'),
+    (b'CWS', 'application/x-shockwave-flash'),
+    (b'\x1aE\xdf\xa3', 'video/webm'),
+)
+_magic_match = re.compile(
+    b'|'.join([b'(' + re.escape(m) + b')' for m, t in _magic])).match
+_magic_types = [t for m, t in _magic]
+
+# Signatures at other offsets
+_magic_at = (
+    (8, b'WAVE', 'audio/x-wav'),
+    (8, b'AVI ', 'video/x-msvideo'),
+    (8, b'WEBP', 'image/webp'),
+    (4, b'ftypqt', 'video/quicktime'),
+    (4, b'ftyp', 'video/mp4'),
+    (257, b'ustar', 'application/x-tar'),
+)
+
+_markup_match = re.compile(
+    br'(?:\xef\xbb\xbf)?\s*(?:(<!doctype\s+html|<html[\s>])|(<\?xml\s))', 
+    re.IGNORECASE).match
+
+_text_chars = bytes(bytearray([7, 8, 9, 10, 12, 13, 27]) 
+                    + bytearray(range(32, 256)))
+
+def _sniff_data(data):
+    """Return the content-type of 'data' determined from its content."""
+    m = _magic_match(data)
+    if m is not None:
+        return _magic_types[m.lastindex - 1]
+    for offset, magic, content_type in _magic_at:
+        if data[offset:offset+len(magic)] == magic:
+            return content_type
+    m = _markup_match(data)
+    if m is not None:
+        return m.lastindex == 1 and 'text/html' or 'text/xml'
+    if not data.translate(None, _text_chars):
+        return 'text/plain'
+    return 'application/octet-stream'
+
+_sniff_cache = LRUCache(2000)
+
+def _sniff(path, entry=None):
+    """Return the content-type of the file 'path' determined from its
+    first bytes. 'entry' is the _Entry of the file if it is known."""
+    if entry is None:
+        entry = _stat_entry(None, path)
+    key = None
+    if entry.ino:
+        key = (entry.dev, entry.ino, entry.mtime, entry.size)
+        content_type = _sniff_cache.get(key)
+        if content_type is not None:
+            return content_type
+    try:
+        fd = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        try:
+            data = os.read(fd, _sniff_read)
+        finally:
+            os.close(fd)
+    except EnvironmentError:
+        return 'application/octet-stream'
+    content_type = _sniff_data(data)
+    if key is not None:
+        _sniff_cache.set(key, content_type)
+    return content_type
 
 _types = {
     '.py': ('text/x-python', 'PythonScript'),
@@ -254,25 +385,77 @@ def _iconmap2list(m):
         l.append("".join((k, m[k])))
     return l
 
-def _create_ob(id, path, _type_map):
+# Object classes that publish the data of the file as it is.
+# Requests for these files can be answered from stat data (see
+# LocalDirectory._getStatOb).
+_static_classes = (None, '', 'File', 'Image')
+
+# Object classes whose construction parses or compiles the source.
+# Objects of these classes are kept in the object cache.
+_cached_classes = ('DTMLMethod', 'DTMLDocument', 'PageTemplate', 
+    'PythonScript')
+
+def _create_ob(id, path, _type_map, _cache=None, entry=None):
     """_create_ob"""
-    ob = None
     ext = os.path.splitext(path)[-1]
-    t, c = _get_content_type(ext.lower(), _type_map)
-    if c is not None:
-        ob = _create_builtin_ob(c, id, path)
-        if ob is None:
-            ob = _create_ob_from_function(c, id, path)
-        if ob is None:
-            ob = _create_ob_from_factory(c, id, path)
+    t, c, create, meta_type = _get_dispatch(_type_map).get(ext.lower(), 
+        _no_dispatch)
+    if _cache is None or c not in _cached_classes:
+        return _build_ob(id, path, t, create, entry)
+    # Cached objects are validated against the identity and the
+    # modification time of the file and against the type map entry. The
+    # file is stat'ed again (once per request): the entry of a cached
+    # listing may be older than the file.
+    entry = _stat_entry(id, path)
+    sig = (entry.dev, entry.ino, entry.mtime, entry.size, t, c)
+    cached = _cache.get(path, check=lambda e: e[0] == sig)
+    if cached is None:
+        ob = _build_ob(id, path, t, create, entry)
+        _cook_ob(ob)
+        cached = (sig, ob)
+        _cache.set(path, cached)
+    return _clone_ob(cached[1])
+
+def _build_ob(id, path, t, create, entry=None):
+    """_build_ob"""
+    ob = None
+    if create is not None:
+        try:
+            ob = create(id, path)
+        except ConflictError:
+            raise
+        except Exception:
+            LOG.debug('Cannot create an object from %s', path, exc_info=True)
     if ob is None:
         ob = _wrap_ob(_create_File(id, path), path)
-    # TODO: avoid this check here
-    file = open(path, 'rb')
     ob.__doc__ = 'LocalFile'
-    _set_content_type(ob, t, file.read(_test_read))
+    _set_content_type(ob, t, path, entry)
     return ob
 
+def _cook_ob(ob):
+    """Compile a template up front so that copies share the result."""
+    try:
+        if hasattr(ob, '_cook_check'):
+            ob._cook_check() # PageTemplate
+        elif hasattr(ob, 'cook'):
+            ob.cook() # DTMLMethod, DTMLDocument
+    except ConflictError:
+        raise
+    except Exception:
+        # The error is raised again when the template is rendered
+        LOG.debug('Cannot compile %r', ob, exc_info=True)
+
+def _clone_ob(ob):
+    """Return a shallow copy of a cached object."""
+    c = ob.__class__
+    if hasattr(c, '__basicnew__'):
+        clone = c.__basicnew__()
+    else:
+        clone = c.__new__(c)
+    clone.__dict__.update(ob.__dict__)
+    clone._p_oid = ob._p_oid
+    return clone
+
 def _create_DTMLMethod(id, path):
     """_create_DTMLMethod"""
     with open(path, 'r') as file:
@@ -283,17 +466,17 @@ def _create_DTMLDocument(id, path):
     with open(path, 'r') as file:
         return OFS.DTMLDocument.DTMLDocument(file.read(), __name__=id)
 
+# Files and images are created from the path of their file: the data is
+# streamed from it when the object is published and never loaded into 
+# memory, and the file is open only while it is read.
+
 def _create_Image(id, path):
     """_create_Image"""
-    with open(path, 'rb') as file:
-        ob = OFS.Image.Image(id, '', file)
-    return ob
+    return StreamingImage(id, '', LocalPath(path))
 
 def _create_File(id, path):
     """_create_File"""
-    with open(path, 'rb') as file: # TODO always mode=b ok?
-        ob = OFS.Image.File(id, '', file)
-    return ob
+    return StreamingFile(id, '', LocalPath(path))
 
 def _create_ZPT(id, path):
     """_create_ZPT"""
@@ -318,40 +501,121 @@ _builtin_create = {
     'PythonScript': _create_PythonScript,
 }
 
-def _create_builtin_ob(c, id, path):
-    try:
-        f = _builtin_create[c]
-        obj = f(id, path)
-        return _wrap_ob(obj, path)
-    except: pass
-    
-def _create_ob_from_function(c, id, path):
-    try:
-        i = c.rindex('.')
-        m, c = c[:i], c[i+1:]
-        m = __import__(m, globals(), locals(), (c,))
-        c = getattr(m, c)
-        f = getattr(c, 'createSelf').__func__ # TODO: does it have __func__?
-        if f.__code__.co_varnames == ('id', 'file'):
-            file = open(path, 'rb') # TODO mode=b?
+############################################################################
+# The type map is compiled into a dispatch table, which maps each file 
+# extension to its content-type, its object class, the function that 
+# creates objects of the class and their meta type. The object class is 
+# resolved once per table:
+#
+# 1. A built-in class (DTMLMethod, DTMLDocument, Image, File, PageTemplate,
+#    PythonScript).
+# 2. 'module.Class' where the class has a createSelf(id, file) function.
+# 3. 'module.Class' of a factory class in an Extensions directory. The
+#    factory is instantiated once.
+#
+# Classes that cannot be resolved are logged once and their files are 
+# created as File objects. The meta type of objects made by a factory is 
+# not known (None) until an object is built, so listings filtered by meta
+# type do not need to build other objects. Tables are memoized by the 
+# identity of the type map, which is replaced when the type_map property
+# changes.
+############################################################################
+
+_builtin_meta_types = {
+    'DTMLMethod': 'DTML Method',
+    'DTMLDocument': 'DTML Document',
+    'Image': 'Image',
+    'File': 'File',
+    'PageTemplate': 'Page Template',
+    'PythonScript': 'Script (Python)',
+}
+
+_no_dispatch = (None, None, None, 'File')
+
+# The files of objects of these meta types hold the data written to them
+# by PUT requests as it is, so PUT bodies are streamed into the files.
+_streamed_meta_types = tuple(_builtin_meta_types.values())
+
+def _resolve_builtin(c):
+    f = _builtin_create.get(c)
+    if f is None:
+        return None
+    def create(id, path):
+        return _wrap_ob(f(id, path), path)
+    return create, _builtin_meta_types[c]
+
+def _resolve_function(c):
+    i = c.rindex('.')
+    m, n = c[:i], c[i+1:]
+    m = __import__(m, globals(), locals(), (n,))
+    klass = getattr(m, n)
+    f = getattr(klass, 'createSelf')
+    f = getattr(f, '__func__', f)
+    if f.__code__.co_varnames != ('id', 'file'):
+        return None
+    def create(id, path):
+        with open(path, 'rb') as file:
             obj = f(id, file)
-            file.close()
-            return _wrap_ob(obj, path)
-    except: pass
-    
-def _create_ob_from_factory(c, id, path):
-    try:
-        i = c.rindex('.')
-        m, c = c[:i], c[i+1:]
-        c = getObject(m, c)
-        f = c()
-        file = open(path, 'rb') # TODO mode=b?
-        obj = f(id, file)
-        file.close()
+        return _wrap_ob(obj, path)
+    return create, getattr(klass, 'meta_type', None)
+
+def _resolve_factory(c):
+    i = c.rindex('.')
+    factory = getObject(c[:i], c[i+1:])()
+    def create(id, path):
+        with open(path, 'rb') as file:
+            obj = factory(id, file)
         ob = _wrap_ob(obj, path)
-        ob.__factory = f
+        ob.__factory = factory
         return ob
-    except: pass
+    return create, None
+
+def _resolve_class(c):
+    """Return a (create, meta_type) tuple for the object class 'c' of a 
+    type map entry. 'create' is None if files are created as File 
+    objects."""
+    if not c:
+        return None, 'File'
+    r = _resolve_builtin(c)
+    if r is None and '.' in c:
+        for resolve in (_resolve_function, _resolve_factory):
+            try:
+                r = resolve(c)
+            except Exception:
+                r = None
+            if r is not None:
+                break
+    if r is None:
+        LOG.warning("Cannot resolve the object class '%s' of the type map; "
+                    "files of this type are published as File objects.", c)
+        return None, 'File'
+    return r
+
+_dispatch_tables = LRUCache(32)
+
+def _get_dispatch(_type_map):
+    """Return the dispatch table of '_type_map', a mapping of extensions to
+    (content_type, class, create, meta_type) tuples."""
+    cached = _dispatch_tables.get(id(_type_map), 
+        check=lambda c: c[0] is _type_map)
+    if cached is None:
+        resolved = {}
+        table = {}
+        for ext, (t, c) in (_type_map or {}).items():
+            if c not in resolved:
+                resolved[c] = _resolve_class(c)
+            table[ext] = (t, c) + resolved[c]
+        cached = (_type_map, table)
+        _dispatch_tables.set(id(_type_map), cached)
+    return cached[1]
+
+def _entry_meta_type(e, _type_map):
+    """Return the meta type of the object of the entry 'e', or None if 
+    it is not known without building the object."""
+    if e.isdir:
+        return 'Local Directory'
+    ext = os.path.splitext(e.name)[-1].lower()
+    return _get_dispatch(_type_map).get(ext, _no_dispatch)[3]
 
 
 class Wrapper:
@@ -365,9 +629,30 @@ class Wrapper:
     # TODO: Zope 4 does not use bobobase* anymore
     def bobobase_modification_time(self):
         """ bobobase_modification_time """
-        t = os.stat(self._local_path)[stat.ST_MTIME]
+        t = _stat(self._local_path)[stat.ST_MTIME]
         return DateTime(t)
     
+    def PUT(self, REQUEST, RESPONSE):
+        """Handle HTTP PUT requests. The body of the request is streamed 
+        into the file, unless the object must parse it to save it."""
+        self.dav__init(REQUEST, RESPONSE)
+        self.dav__simpleifhandler(REQUEST, RESPONSE, refresh=1)
+        parent = Acquisition.aq_parent(Acquisition.aq_inner(self))
+        if self.meta_type in _streamed_meta_types and \
+                hasattr(parent, '_putFile'):
+            if not parent._putFile(os.path.basename(self._local_path), 
+                    REQUEST):
+                # A Content-Range upload that is not complete yet
+                return RESPONSE
+        else:
+            self.__class__.__bases__[-1].PUT(self, REQUEST, RESPONSE)
+            _save_ob(self, self._local_path, 
+                getattr(self, 'fsync_writes', 0))
+        RESPONSE.setStatus(204)
+        return RESPONSE
+
+    manage_FTPput = PUT
+
     def __repr__(self):
         """ __repr__ """
         c = self.__class__.__bases__[-1].__name__
@@ -396,7 +681,7 @@ _wrapper_method = '''def %(name)s %(arglist)s:
     """Wrapper for the %(name)s method."""
     r = self.__class__.__bases__[-1].%(name)s(*%(baseargs)s)
     try:
-        _save_ob(self, self._local_path)
+        _save_ob(self, self._local_path, getattr(self, 'fsync_writes', 0))
     except ValueError: pass
     return r
 '''
@@ -413,7 +698,6 @@ def _get_wrapper(c):
         _wrap_method(ObjectWrapper, 'pt_edit')
         _wrap_method(ObjectWrapper, 'write') # PythonScript
         _wrap_method(ObjectWrapper, 'ZBindingsHTML_editAction') # PythonScript
-        _wrap_method(ObjectWrapper, 'PUT')
         # Remove management options that cannot be used 
         manage_options = []
         for opt in ObjectWrapper.manage_options:
@@ -460,24 +744,378 @@ def _wrap_ob(ob, path):
     ob._p_oid = path
     return ob
 
-def _save_DTML(ob, path):
-    f = open(path, 'w')
+############################################################################
+# Files are written to a temporary file in the target directory, which
+# then replaces the target with os.replace. Readers of the old file keep
+# reading it, and nobody sees a partially written file. The temporary 
+# file name starts with '_', so valid_id hides it from listings.
+#
+# If the data is a complete file on the same file system, such as the
+# spool file of an upload, the temporary file is a hard link to it and 
+# no data is copied. Otherwise the data is copied with copy_file_range 
+# where possible, or with large buffers. With 'fsync' the file and its 
+# directory are flushed to disk before the write returns.
+############################################################################
+
+_copy_size = 1 << 20
+_copy_file_range = getattr(os, 'copy_file_range', None)
+
+# The umask of the process, read once while importing
+_umask = os.umask(0)
+os.umask(_umask)
+
+def _temp_path(path):
+    """Return a new temporary file name in the directory of 'path'."""
+    head, tail = os.path.split(path)
+    return os.path.join(head, '_%s.%s.tmp' % (tail, uuid.uuid4().hex[:12]))
+
+def _fileno(data):
+    """Return the file descriptor of the file object 'data' or None."""
+    try:
+        return data.fileno()
+    except Exception:
+        return None
+
+def _link_file(data, tmp, size=None):
+    """Hard link 'tmp' to the file of the file object 'data' and return 
+    true, or return false if that is not possible. If 'size' is given, 
+    the file is linked only if it has that size."""
+    fd = _fileno(data)
+    if fd is None:
+        return 0
     try:
-       f.write(ob.read())
+        if size is not None and os.fstat(fd).st_size != size:
+            return 0
+        if hasattr(data, 'flush'):
+            data.flush()
+        name = getattr(data, 'name', None)
+        if isinstance(name, str) and os.path.isabs(name) and \
+                os.path.samestat(os.stat(name), os.fstat(fd)):
+            os.link(name, tmp)
+        else:
+            # Anonymous temporary files can be linked on Linux
+            os.link('/proc/self/fd/%d' % fd, tmp)
+    except (OSError, ValueError, NotImplementedError):
+        return 0
+    return 1
+
+def _write_all(fd, data):
+    """Write the bytes 'data' to the file descriptor 'fd'."""
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+def _copy_data(data, fd, size=None):
+    """Write 'data' (bytes, text or a file object) to 'fd'. If 'size' is
+    given, at most 'size' bytes are copied from a file object."""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        _write_all(fd, data)
+        return
+    if isinstance(data, Pdata):
+        _copy_pdata(data, fd)
+        return
+    remaining = size
+    src = _fileno(data)
+    if src is not None and _copy_file_range is not None:
+        try:
+            while remaining is None or remaining > 0:
+                n = _copy_size
+                if remaining is not None:
+                    n = min(n, remaining)
+                n = _copy_file_range(src, fd, n)
+                if not n:
+                    break
+                if remaining is not None:
+                    remaining -= n
+            return
+        except OSError:
+            # Not supported for these files, copy the rest below
+            data.seek(os.lseek(src, 0, os.SEEK_CUR))
+    read = data.read
+    while remaining is None or remaining > 0:
+        n = _copy_size
+        if remaining is not None:
+            n = min(n, remaining)
+        chunk = read(n)
+        if not chunk:
+            break
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        _write_all(fd, chunk)
+        if remaining is not None:
+            remaining -= len(chunk)
+
+def _copy_sdata(data, fd):
+    """Copy the data of the streamed file 'data' (an Sdata chunk and the 
+    chunks after it) to 'fd' with copy_file_range and return true, or
+    return false if that is not possible."""
+    if _copy_file_range is None:
+        return 0
+    src = owned = None
+    try:
+        if isinstance(data.file, LocalPath):
+            src = owned = data.file.open()
+        else:
+            src = _fileno(data.file)
+        if src is None:
+            return 0
+        offset, end = data.offset, data.fsize
+        while offset < end:
+            n = _copy_file_range(src, fd, min(_copy_size, end - offset), 
+                offset)
+            if not n:
+                break
+            offset += n
+        return 1
+    except OSError:
+        # Not supported for these files, start again with the chunks
+        os.ftruncate(fd, 0)
+        os.lseek(fd, 0, os.SEEK_SET)
+        return 0
     finally:
-       f.close()
+        if owned is not None:
+            os.close(owned)
+
+def _copy_pdata(data, fd):
+    """Write the chain of Pdata chunks starting at 'data' to 'fd', one 
+    chunk at a time. The data of a streamed file is copied from its file
+    with copy_file_range where possible."""
+    if isinstance(data, Sdata) and _copy_sdata(data, fd):
+        return
+    while data is not None:
+        chunk = data.data
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        _write_all(fd, chunk)
+        data = data.next
+
+def _request_body(REQUEST):
+    """Return the body of a request and its size, if it is known. The 
+    body is returned as a file object positioned at its start, if the
+    request has a body file."""
+    try:
+        size = int(REQUEST.get_header('Content-Length', None))
+    except (TypeError, ValueError):
+        size = -1
+    body = REQUEST.get('BODYFILE', None)
+    if body is None:
+        return REQUEST.get('BODY', b''), size
+    body.seek(0)
+    return body, size
+
+def _fsync_dir(path):
+    """Flush the directory 'path' to disk, where that is possible."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def _write_atomic(path, data, fsync=0, size=None):
+    """Replace the file 'path' with 'data' (bytes, text or a file object
+    positioned at the start of the data). 'size' is the size of the data
+    in a file object, if it may be followed by other data: no more than
+    'size' bytes are written."""
+    tmp = _temp_path(path)
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except OSError:
+        mode = None
+    try:
+        if _link_file(data, tmp, size):
+            if mode is None:
+                mode = 0o666 & ~_umask
+            if fsync:
+                fd = os.open(tmp, os.O_RDONLY)
+                try: os.fsync(fd)
+                finally: os.close(fd)
+        else:
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL | 
+                getattr(os, 'O_BINARY', 0), 0o666)
+            try:
+                _copy_data(data, fd, size)
+                if fsync:
+                    os.fsync(fd)
+            finally:
+                os.close(fd)
+        if mode is not None:
+            os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except:
+        try: os.unlink(tmp)
+        except OSError: pass
+        raise
+    if fsync:
+        _fsync_dir(os.path.dirname(path) or os.curdir)
+
+def _rename_atomic(src, path, fsync=0):
+    """Replace the file 'path' with the file 'src', keeping the mode of
+    'path'. 'src' is copied if it is on another file system."""
+    try:
+        os.chmod(src, stat.S_IMODE(os.stat(path).st_mode))
+    except OSError:
+        pass
+    try:
+        os.replace(src, path)
+    except OSError as err:
+        if err.errno != errno.EXDEV:
+            raise
+        with open(src, 'rb') as f:
+            _write_atomic(path, f, fsync)
+        os.unlink(src)
+        return
+    if fsync:
+        _fsync_dir(os.path.dirname(path) or os.curdir)
+
+############################################################################
+# Pasting copies files on the file system. The data of a file is shared 
+# with a reflink (FICLONE) where the file system supports it, else copied
+# in the kernel with copy_file_range or sendfile, else with 1 MB buffers.
+# Files are copied to a temporary file and directories to a temporary
+# directory, which are renamed to the target when they are complete.
+############################################################################
+
+# The Linux ioctl that makes a file share the data of another file
+_FICLONE = 0x40049409
+_sendfile = getattr(os, 'sendfile', None)
 
-def _save_File(ob, path):
-    if isinstance(ob.data, Pdata):
-        f = open(path, 'wb')
-        f.write(str(ob.data))
-        f.close()
+def _clone_file(src, fd):
+    """Make the file 'fd' share the data of the file 'src' and return
+    true, or return false if the file system does not support that."""
+    if fcntl is None or not sys.platform.startswith('linux'):
+        return 0
+    try:
+        fcntl.ioctl(fd, _FICLONE, src)
+    except OSError:
+        return 0
+    return 1
+
+def _copy_fd(src, fd, size):
+    """Copy 'size' bytes from the start of the file 'src' to 'fd'."""
+    if _clone_file(src, fd):
+        return
+    offset = 0
+    if _copy_file_range is not None:
+        try:
+            while offset < size:
+                n = _copy_file_range(src, fd, min(_copy_size, size - offset),
+                    offset)
+                if not n:
+                    return
+                offset += n
+            return
+        except OSError:
+            # Not supported for these files, copy the rest below
+            pass
+    if _sendfile is not None:
+        try:
+            while offset < size:
+                n = _sendfile(fd, src, offset, min(_copy_size, size - offset))
+                if not n:
+                    return
+                offset += n
+            return
+        except OSError:
+            pass
+    os.lseek(src, offset, os.SEEK_SET)
+    while offset < size:
+        chunk = os.read(src, min(_copy_size, size - offset))
+        if not chunk:
+            return
+        _write_all(fd, chunk)
+        offset += len(chunk)
+
+def _copy_new_file(src, dst, fsync=0):
+    """Copy the file 'src' to the new file 'dst' with the mode of 'src'.
+    """
+    sfd = os.open(src, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    try:
+        st = os.fstat(sfd)
+        fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL | 
+            getattr(os, 'O_BINARY', 0), 0o600)
+        try:
+            _copy_fd(sfd, fd, st.st_size)
+            if fsync:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.chmod(dst, stat.S_IMODE(st.st_mode))
+    finally:
+        os.close(sfd)
+
+def _copy_new_dir(src, dst, fsync=0):
+    """Copy the directory 'src' and its contents to the new directory
+    'dst'. Symbolic links are copied as links."""
+    os.mkdir(dst)
+    with os.scandir(src) as it:
+        for e in it:
+            target = os.path.join(dst, e.name)
+            if e.is_symlink():
+                os.symlink(os.readlink(e.path), target)
+            elif e.is_dir():
+                _copy_new_dir(e.path, target, fsync)
+            elif e.is_file():
+                _copy_new_file(e.path, target, fsync)
+    shutil.copymode(src, dst)
+    if fsync:
+        _fsync_dir(dst)
+
+def _copy_path(src, path, fsync=0):
+    """Copy the file or directory 'src' to 'path'. The copy is made in a
+    temporary file or directory, which replaces 'path' when it is 
+    complete."""
+    tmp = _temp_path(path)
+    try:
+        if os.path.isdir(src):
+            _copy_new_dir(src, tmp, fsync)
+            os.rename(tmp, path)
+        else:
+            _copy_new_file(src, tmp, fsync)
+            os.replace(tmp, path)
+    except:
+        if os.path.isdir(tmp):
+            shutil.rmtree(tmp, ignore_errors=1)
+        else:
+            try: os.unlink(tmp)
+            except OSError: pass
+        raise
+    if fsync:
+        _fsync_dir(os.path.dirname(path) or os.curdir)
+
+def _move_path(src, path, fsync=0):
+    """Rename the file or directory 'src' to 'path'. Across file systems
+    'src' is copied with _copy_path and then removed."""
+    try:
+        os.rename(src, path)
+        return
+    except OSError as err:
+        if err.errno != errno.EXDEV:
+            raise
+    _copy_path(src, path, fsync)
+    if os.path.isdir(src) and not os.path.islink(src):
+        shutil.rmtree(src)
     else:
-        f = open(path, 'wb')
-        f.write(ob.data)
-        f.close()
+        os.unlink(src)
+
+def _save_DTML(ob, path, fsync=0):
+    _write_atomic(path, ob.read(), fsync)
 
-def _save_Folder(ob, path):
+def _save_File(ob, path, fsync=0):
+    if isinstance(ob.data, Sdata) and \
+            getattr(ob.data.file, 'name', None) == path:
+        # The data is still streamed from the file itself
+        return
+    # Pdata chains are written chunk by chunk, see _copy_pdata
+    _write_atomic(path, ob.data, fsync)
+
+def _save_Folder(ob, path, fsync=0):
     os.mkdir(path)
     
 _builtin_save = {
@@ -490,12 +1128,13 @@ _builtin_save = {
     'Page Template': _save_DTML,
 }
 
-def _save_builtin_ob(ob, path):
+def _save_builtin_ob(ob, path, fsync=0):
     try: 
         f = _builtin_save[ob.meta_type]
-        f(ob, path)
-        return 1
-    except KeyError: pass
+    except KeyError:
+        return
+    f(ob, path, fsync)
+    return 1
 
 def _save_ob_with_function(ob, path):
     try:
@@ -509,22 +1148,397 @@ def _save_ob_with_factory(ob, path):
         return 1
     except: pass
     
-def _save_ob(ob, path):
-    s = _save_builtin_ob(ob, path)
-    if not s:
-        s = _save_ob_with_function(ob, path)
-    if not s:
-        s = _save_ob_with_factory(ob, path)
+def _save_ob(ob, path, fsync=0):
+    try:
+        s = _save_builtin_ob(ob, path, fsync)
+        if not s:
+            s = _save_ob_with_function(ob, path)
+        if not s:
+            s = _save_ob_with_factory(ob, path)
+    finally:
+        _invalidate_stats()
     if not s:
         raise TypeError("Cannot save files of type '%s'." % ob.meta_type)
 
-def _set_timestamp(ob, path):
-    t = os.stat(path)[stat.ST_MTIME]
-    t = TimeStamp(*time.gmtime(t)[:6])
+def _set_timestamp(ob, mtime):
+    t = TimeStamp(*time.gmtime(mtime)[:6])
     ob._p_serial = t.raw()
+
+############################################################################
+# Directory listings are read with a single os.scandir pass. Each entry
+# is recorded with its type, size and modification time, so that listing
+# code never has to stat the entry again. Directories have a size of None,
+# entries that cannot be stat'ed have a size of -1 and an mtime of None.
+############################################################################
+
+_Entry = namedtuple('_Entry', 'name isdir size mtime dev ino')
+
+############################################################################
+# A file filter is a space separated list of glob patterns (or a list of
+# patterns) matched against the entry names of a directory:
+#
+# - A pattern ending with a path separator ('*/') only matches directories.
+# - A pattern starting with '!' excludes the entries it matches.
+# - If there are only exclude patterns, all other entries are included.
+# - Like glob, include patterns only match names starting with '.' if
+#   the pattern itself starts with '.'.
+#
+# Filters are compiled once into regular expressions and memoized.
+############################################################################
+
+_filter_flags = _iswin32 and re.IGNORECASE or 0
+
+def _compile_patterns(patterns):
+    """Compile a list of glob patterns into a single match function."""
+    if not patterns:
+        return None
+    expr = '|'.join(['(?:%s)' % fnmatch.translate(p) for p in patterns])
+    return re.compile(expr, _filter_flags).match
+
+class _FileFilter:
+    """Precompiled file filter"""
+
+    def __init__(self, patterns):
+        files, dirs, xfiles, xdirs = [], [], [], []
+        lists = {(0, 0): files, (0, 1): dirs, (1, 0): xfiles, (1, 1): xdirs}
+        for p in patterns:
+            exclude = p[:1] == '!'
+            if exclude:
+                p = p[1:]
+            isdir = p[-1:] in ('/', '\\')
+            if isdir:
+                p = p[:-1]
+            if not p:
+                continue
+            lists[exclude, isdir].append(p)
+        self.include = bool(files or dirs)
+        # A '*/' pattern includes all directories, as in earlier versions
+        alldirs = '*' in dirs
+        dirs = files + dirs
+        self._files = _compile_patterns(files)
+        self._dirs = _compile_patterns(dirs)
+        self._dotfiles = _compile_patterns([p for p in files if p[:1] == '.'])
+        self._dotdirs = _compile_patterns(alldirs and ['*'] or 
+            [p for p in dirs if p[:1] == '.'])
+        self._xfiles = _compile_patterns(xfiles)
+        self._xdirs = _compile_patterns(xfiles + xdirs)
+
+    def __call__(self, name, isdir):
+        """Return true if the entry 'name' passes the filter."""
+        if isdir:
+            exclude = self._xdirs
+            include = self._dirs
+            if name[:1] == '.': include = self._dotdirs
+        else:
+            exclude = self._xfiles
+            include = self._files
+            if name[:1] == '.': include = self._dotfiles
+        if exclude is not None and exclude(name):
+            return 0
+        if not self.include:
+            return 1
+        return include is not None and include(name) is not None
+
+@lru_cache(maxsize=64)
+def _compile_filter(patterns):
+    """_compile_filter"""
+    return _FileFilter(patterns)
+
+def _spec_key(spec):
+    """Return 'spec' as a hashable tuple of patterns or None."""
+    if spec is None:
+        return None
+    if isinstance(spec, str):
+        spec = spec.split()
+    return tuple(spec)
+
+def _get_filter(spec):
+    """Return the precompiled filter for 'spec' or None."""
+    spec = _spec_key(spec)
+    if spec is None:
+        return None
+    return _compile_filter(spec)
+
+############################################################################
+# Within a request the same paths are stat'ed by traversal, by the object
+# factories and by the listing code. _stat memoizes the results in a
+# StatMemo kept in the 'other' mapping of the current request, so that
+# each path is stat'ed once per request. Directory scans prime the memo,
+# and every write made through LocalFS invalidates it. Outside of a
+# request _stat is a plain os.stat.
+############################################################################
+
+_stat_memo_key = 'LocalFS_stat_memo'
+
+def _get_stat_memo(create=1):
+    """Return the StatMemo of the current request or None."""
+    other = getattr(getRequest(), 'other', None)
+    if other is None:
+        return None
+    memo = other.get(_stat_memo_key)
+    if memo is None and create:
+        memo = other[_stat_memo_key] = StatMemo()
+    return memo
+
+def _stat(path):
+    """Return os.stat(path), memoized for the current request."""
+    memo = _get_stat_memo()
+    if memo is None:
+        return os.stat(path)
+    return memo.stat(path)
+
+def _isfile(path):
+    """os.path.isfile using the memoized stat."""
+    try:
+        return stat.S_ISREG(_stat(path).st_mode)
+    except (OSError, ValueError):
+        return False
+
+def _invalidate_stats():
+    """Drop the memoized stats of the current request after a write."""
+    memo = _get_stat_memo(0)
+    if memo is not None:
+        memo.invalidate()
+
+def _make_entry(name, st):
+    """Return an _Entry for 'name' from the stat result 'st'."""
+    if stat.S_ISDIR(st.st_mode):
+        return _Entry(name, 1, None, st.st_mtime, st.st_dev, st.st_ino)
+    return _Entry(name, 0, st.st_size, st.st_mtime, st.st_dev, st.st_ino)
+
+def _stat_entry(name, path):
+    """Return an _Entry for the file 'path'."""
+    try:
+        return _make_entry(name, _stat(path))
+    except (OSError, ValueError):
+        return _Entry(name, 0, -1, None, None, None)
+
+def _scandir(path, prime=None):
+    """Return a list of _Entry records for the directory 'path'.
+    If 'prime' is given it is called with the name and the stat result 
+    of each entry."""
+    entries = []
+    a = entries.append
+    with os.scandir(path) as it:
+        for e in it:
+            try:
+                st = e.stat()
+                if prime is not None:
+                    prime(e.name, st)
+                a(_make_entry(e.name, st))
+            except OSError:
+                a(_Entry(e.name, 0, -1, None, None, None))
+    return entries
     
+def _scan_subdirs(path, match=None, first=0):
+    """Return the sorted names of the subdirectories of 'path'. Only the
+    entry types reported by os.scandir are used, so entries are not 
+    stat'ed on file systems that report them. If 'first' is true, the
+    scan stops at the first subdirectory."""
+    names = []
+    with os.scandir(path) as it:
+        for e in it:
+            name = e.name
+            if not valid_id(name):
+                continue
+            try:
+                if not e.is_dir():
+                    continue
+            except OSError:
+                continue
+            if match is None or match(name, 1):
+                names.append(name)
+                if first:
+                    break
+    names.sort()
+    return names
+
+############################################################################
+# LocalDirectory.walk and find visit a tree in sorted, depth first order.
+# The directories next in line are scanned ahead on a small thread pool,
+# which hides the latency of remote file systems, while the results are
+# still generated one directory at a time. The worker threads only touch
+# the file system and the values passed to them.
+############################################################################
+
+def _walk_scan(path, match):
+    """Return the sorted directory and file _Entry lists of the directory
+    'path', or None if it cannot be read."""
+    try:
+        entries = _scandir(path)
+    except OSError:
+        return None
+    entries.sort()
+    dirs, files = [], []
+    for e in entries:
+        if not valid_id(e.name):
+            continue
+        if match is not None and not match(e.name, e.isdir):
+            continue
+        if e.isdir:
+            dirs.append(e)
+        else:
+            files.append(e)
+    return dirs, files
+
+def _walk(top, match, workers):
+    """Generate (relative path, directories, files) for the tree 'top'.
+    Subdirectories removed from 'directories' by the consumer are not
+    visited. Symbolic links to directories are followed, except links
+    to a directory (by st_dev and st_ino) that is being visited already
+    (an ancestor), which would loop."""
+    window = workers * 4
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        st = os.stat(top)
+        ancestors = frozenset([(st.st_dev, st.st_ino)])
+    except OSError:
+        ancestors = frozenset()
+    # The stack holds [relative path, future, keys of the directory and
+    # its ancestors] items, the next item last
+    stack = [['', None, ancestors]]
+    try:
+        while stack:
+            for item in stack[:-window-1:-1]:
+                if item[1] is None:
+                    item[1] = executor.submit(
+                        _walk_scan, os.path.join(top, item[0]), match)
+            rel, future, ancestors = stack.pop()
+            r = future.result()
+            if r is None:
+                continue
+            dirs, files = r
+            yield rel, dirs, files
+            prefix = rel and rel + '/' or ''
+            for e in reversed(dirs):
+                keys = ancestors
+                if e.ino is not None:
+                    key = (e.dev, e.ino)
+                    if key in ancestors:
+                        continue
+                    keys = ancestors | {key}
+                stack.append([prefix + e.name, None, keys])
+    finally:
+        for item in stack:
+            if item[1] is not None:
+                item[1].cancel()
+        executor.shutdown(wait=False)
+
+def _timestamp(t):
+    """Return the DateTime, number or string 't' as seconds since the 
+    epoch."""
+    if t is None or t == '':
+        return None
+    if hasattr(t, 'timeTime'):
+        return t.timeTime()
+    try:
+        return float(t)
+    except ValueError:
+        return DateTime(t).timeTime()
+
+def _query_params(min_size, max_size, newer, older):
+    """Return the size bounds of a query as integers and the time bounds
+    as seconds since the epoch, or None if they are not given. They 
+    arrive as strings from requests."""
+    try:
+        if min_size is not None and min_size != '':
+            min_size = int(min_size)
+        else:
+            min_size = None
+        if max_size is not None and max_size != '':
+            max_size = int(max_size)
+        else:
+            max_size = None
+        return min_size, max_size, _timestamp(newer), _timestamp(older)
+    except (TypeError, ValueError, DateTimeError):
+        raise BadRequest('Invalid query parameters')
+
+############################################################################
+# Listings are sorted on keys computed from the _Entry records alone, with
+# directories before files. Only the entries of the requested page are 
+# selected (with heapq for pages near the start of a large directory) 
+# and turned into LocalFile objects.
+############################################################################
+
+def _entry_content_type(e, path, _type_map):
+    """Return the content-type of the entry 'e' of the file 'path'."""
+    if e.isdir:
+        return 'directory'
+    t, c = _get_content_type(e.name, _type_map)
+    if t:
+        return t
+    return _guess_content_type(e.name, path, e)
+
+def _entry_type(e, _type_map):
+    """Return the content-type of an entry as guessed from its name."""
+    if e.isdir:
+        return 'directory'
+    t = _get_content_type(e.name, _type_map)[0]
+    return t or mimetypes.guess_type(e.name)[0] or ''
+
+_sort_keys = {
+    'id': lambda e, m: e.name,
+    'size': lambda e, m: (e.size or 0, e.name),
+    'mtime': lambda e, m: (e.mtime or 0, e.name),
+    'type': lambda e, m: (_entry_type(e, m), e.name),
+}
+
+def _batch_params(reverse, b_start, b_size):
+    """Return the reverse, b_start and b_size parameters of a listing as
+    a boolean and integers. They arrive as strings from requests and the
+    ZMI; b_size is None if it is not given."""
+    try:
+        reverse = bool(int(reverse or 0))
+        b_start = max(int(b_start or 0), 0)
+        if b_size is not None and b_size != '':
+            b_size = max(int(b_size), 0)
+        else:
+            b_size = None
+    except (TypeError, ValueError):
+        raise BadRequest('Invalid listing parameters')
+    return reverse, b_start, b_size
+
+def _sort_entries(entries, sort_on, reverse, b_start, b_size, _type_map):
+    """Return the entries of one page of a sorted listing."""
+    try:
+        key = _sort_keys[sort_on]
+    except KeyError:
+        raise BadRequest('Cannot sort on %s' % repr(sort_on))
+    b_start = max(int(b_start or 0), 0)
+    dirs = [e for e in entries if e.isdir]
+    files = [e for e in entries if not e.isdir]
+    k = lambda e: key(e, _type_map)
+    if b_size is None:
+        dirs.sort(key=k, reverse=reverse)
+        files.sort(key=k, reverse=reverse)
+        return (dirs + files)[b_start:]
+    end = b_start + max(int(b_size), 0)
+    r = []
+    for group in (dirs, files):
+        n = end - len(r)
+        if n <= 0:
+            break
+        if n * 4 < len(group):
+            select = reverse and heapq.nlargest or heapq.nsmallest
+            r.extend(select(n, group, key=k))
+        else:
+            group.sort(key=k, reverse=reverse)
+            r.extend(group[:n])
+    return r[b_start:end]
+
 _marker = []
 
+# The maximum number of missing names cached per directory
+_missing_size = 1000
+
+# The default file name of the metadata index in the base path
+_index_name = '_LocalFS_index.db'
+
+# The staging directory of chunked uploads in the base path
+_staging_name = '_uploads'
+
+_content_range = re.compile(r'bytes\s+(?:(\d+)-(\d+)|\*)/(\d+|\*)$').match
+
 def valid_id(id):
     if id == os.curdir or id == os.pardir or id[0] == '_':
         return 0
@@ -572,6 +1586,9 @@ class LocalDirectory(
         )
 
     icon = 'misc_/OFSP/Folder_icon.gif'
+
+    # The number of entries shown on one page of the Contents view
+    manage_batch_size = 1000
     
     security = AccessControl.ClassSecurityInfo()
 
@@ -598,20 +1615,29 @@ class LocalDirectory(
         """ bobo_traverse """
         # import pdb; pdb.set_trace()
         method = REQUEST.get('REQUEST_METHOD', 'GET').upper()
-        try:
+        if method == 'PUT' and not REQUEST.get('TraversalRequestNameStack'):
             # FTP - PUT
-            if not method in ('GET', 'POST', 'HEAD'):
-               return None # LockNullResource(self, name, REQUEST).__of__(self)
-        except:
-            pass
+            return self._getPutOb(name)
+        if not method in ('GET', 'POST', 'HEAD'):
+            return None
+        if method in ('GET', 'HEAD') and \
+                not REQUEST.get('TraversalRequestNameStack'):
+            ob = self._getStatOb(name, REQUEST, method)
+            if ob is not None:
+                return ob
         try:
             return self._safe_getOb(name)
         except:
             pass
+        # The name has been looked up in the directory already, 
+        # so __getattr__ must not look it up again.
+        self._v_probed = name
         try:
             return getattr(self, name)
         except AttributeError: 
             pass
+        finally:
+            self._v_probed = None
         # ***Andreas did not apply this change from SmilyChris because I do 
         # *** not need to handle errors if self._save_getOb(name) fails
         # It fails on Zope2.7b3+ so LocalFS is broken 
@@ -629,6 +1655,10 @@ class LocalDirectory(
             raise TypeError('index must be a string')
         
     def __getattr__(self, attr):
+        # Names starting with '_' (such as __bool__ and __len__, which are
+        # looked up by truth tests) are not valid file ids.
+        if attr[:1] == '_' or attr == self.__dict__.get('_v_probed'):
+            raise AttributeError(attr)
         try:
             return self._safe_getOb(attr)
         except NotFound:
@@ -637,45 +1667,85 @@ class LocalDirectory(
     def _getpath(self, id):
         return os.path.join(self.basepath, id)
 
-    def _getfileob(self, id, spec=None):
+    def _getRoot(self):
+        """Return the LocalFS object of this directory. The root is not
+        tested for truth, which would look up __bool__ or __len__."""
+        if self.root is not None:
+            return self.root
+        return self
+    
+    def _getCache(self, name):
+        """Return the cache 'name' shared by all directories of the LocalFS.
+        The size of the cache is the LocalFS property '<name>_cache_size'."""
+        root = self._getRoot()
+        size = getattr(root, '%s_cache_size' % name, 0)
+        return getCache(name, root.basepath, size)
+
+    def _getfileob(self, id, spec=None, entry=None):
         if spec is None:
             spec=self.file_filter
         path = self._getpath(id)
-        return LocalFile(self, id, path, spec)
+        return LocalFile(self, id, path, spec, entry)
     
     def _ids(self, spec=None):
+        return [e.name for e in self._entries(spec)]
+
+    def _entries(self, spec=None):
+        """Return the sorted list of _Entry records of this directory.
+        Listings are cached while the mtime and ctime of the directory
+        are unchanged, so the returned list must not be modified."""
         if spec is None:
             spec=self.file_filter
+        key = _spec_key(spec)
+        path = os.path.normpath(self.basepath)
         try:
-            ids = os.listdir(self.basepath)
+            st = _stat(path)
+            sig = (st.st_mtime_ns, st.st_ctime_ns)
+            now = time.time()
+            cache = self._getCache('listing')
+            cached = cache.get(path, 
+                check=lambda c: c[0] == sig and (c[1] is None or c[1] > now))
+            if cached is not None:
+                try:
+                    return cached[2][key]
+                except KeyError: pass
+            memo = _get_stat_memo()
+            prime = None
+            if memo is not None:
+                getpath = self._getpath
+                prime = lambda name, st: memo.prime(getpath(name), st)
+            entries = _scandir(path, prime)
         except (OSError, IOError) as err:
-            if err[0] == errno.EACCES:
+            if err.errno == errno.EACCES:
                 raise Forbidden(HTTPResponse()._error_html(
                     'Forbidden',
                     'Sorry, you do not have permission to read '
                     'the requested directory.<p>'))
             else: raise
-        if (spec is not None):
-            try:
-                if (type(spec) is type('')):
-                    spec = spec.split(' ')
-                curdir = os.getcwd()
-                os.chdir(self.basepath)
-                l = []
-                for id in ids:
-                    if os.path.isdir(id) and '*/' in spec or '*\\' in spec:
-                        l.append(id)
-                for patt in spec:
-                    names = glob.glob(patt)
-                    for id in names:
-                        if id[-1] == os.sep: id = id[:-1]
-                        if (id not in l):
-                            l.append(id)
-                ids = l
-            finally:
-                os.chdir(curdir)
-        ids = sorted(filter(valid_id, ids))
-        return ids
+        match = _get_filter(spec)
+        if match is None:
+            entries = [e for e in entries if valid_id(e.name)]
+        else:
+            entries = [e for e in entries 
+                       if valid_id(e.name) and match(e.name, e.isdir)]
+        entries.sort()
+        if cached is None:
+            ttl = self._getRoot().listing_cache_ttl
+            cached = (sig, ttl > 0 and now + ttl or None, {})
+            cache.set(path, cached)
+        cached[2][key] = entries
+        return entries
+
+    def _invalidate(self, path=None):
+        """Drop the cached listing and the cached missing names of the 
+        directory 'path', which defaults to this directory."""
+        if path is None:
+            path = self.basepath
+        path = os.path.normpath(path)
+        self._getCache('listing').pop(path)
+        self._getCache('negative').pop(path)
+        self._getCache('tree').pop(path)
+        _invalidate_stats()
         
     def _safe_getOb(self, name, default=_marker):
         return self._getOb(name, default)
@@ -683,18 +1753,99 @@ class LocalDirectory(
     def _getOb(self, id, default=_marker):
         if id in (os.curdir, os.pardir):
             raise ValueError(id)
-        ob = None
         path = self._getpath(id)
-        if os.path.isdir(path):
-            ob = LocalDirectory(id, path, self.root or self, self.tree_view,
+        missing = self._getMissing()
+        if id not in missing:
+            try:
+                st = _stat(path)
+            except (OSError, ValueError):
+                st = None
+            if st is not None and (stat.S_ISDIR(st.st_mode) 
+                                   or stat.S_ISREG(st.st_mode)):
+                return self._getEntryOb(_make_entry(id, st))
+            if len(missing) >= _missing_size:
+                missing.clear()
+            missing.add(id)
+        if default is _marker:
+            raise AttributeError(id)
+        return default
+
+    def _getMissing(self):
+        """Return the set of names known not to exist in this directory.
+        The set is shared by all directory objects of the LocalFS and is 
+        valid while the mtime and ctime of the directory are unchanged."""
+        path = os.path.normpath(self.basepath)
+        try:
+            st = _stat(path)
+        except (OSError, ValueError):
+            return set()
+        sig = (st.st_mtime_ns, st.st_ctime_ns)
+        cache = self._getCache('negative')
+        cached = cache.get(path, check=lambda c: c[0] == sig)
+        if cached is None:
+            cached = (sig, set())
+            cache.set(path, cached)
+        return cached[1]
+
+    def _getStatOb(self, id, REQUEST, method):
+        """Return a LocalFileStat if a request for the file 'id' can be
+        answered from its stat data alone, otherwise None. That is the
+        case for HEAD requests and for conditional GET requests of an
+        unchanged file, if the file would be published as a File or
+        Image."""
+        if method == 'GET' and \
+                REQUEST.get_header('If-None-Match', None) is None and \
+                REQUEST.get_header('If-Modified-Since', None) is None:
+            return None
+        if id in (os.curdir, os.pardir) or id in self._getMissing():
+            return None
+        t, c = _get_content_type(id, self._type_map)
+        if c not in _static_classes:
+            return None
+        path = self._getpath(id)
+        entry = _stat_entry(id, path)
+        if entry.isdir or entry.mtime is None:
+            return None
+        etag = stat_etag(entry.ino, entry.size, entry.mtime)
+        if method == 'GET' and not not_modified(REQUEST, etag, entry.mtime):
+            return None
+        content_type = t or _guess_content_type(id, path, entry)
+        return LocalFileStat(id, entry, content_type, etag).__of__(self)
+
+    def _getPutOb(self, id):
+        """Return the object that handles a PUT request for the file 'id'.
+        A file that PUT replaces with the request body as it is (and that
+        is not locked by WebDAV) is not built, since its object would 
+        only be thrown away."""
+        if id in (os.curdir, os.pardir):
+            raise ValueError(id)
+        path = self._getpath(id)
+        try:
+            st = _stat(path)
+        except (OSError, ValueError):
+            st = None
+        if st is None or not (stat.S_ISDIR(st.st_mode) 
+                              or stat.S_ISREG(st.st_mode)):
+            return LocalNullResource(id).__of__(self)
+        entry = _make_entry(id, st)
+        if not entry.isdir and not Wrapper._dav_writelocks.get(path) and \
+                _entry_meta_type(entry, self._type_map) in \
+                _streamed_meta_types:
+            return LocalFileResource(id).__of__(self)
+        return self._getEntryOb(entry)
+
+    def _getEntryOb(self, entry):
+        """Return the Zope object for an _Entry of this directory."""
+        id = entry.name
+        path = self._getpath(id)
+        if entry.isdir:
+            ob = LocalDirectory(id, path, self._getRoot(), self.tree_view,
                 self.catalog, self._type_map, self._icon_map)
-        elif os.path.isfile(path):
-            ob = _create_ob(id, path, self._type_map)
-        if ob is None:
-            if default is _marker:
-                raise AttributeError(id)
-            return default
-        _set_timestamp(ob, path)
+        else:
+            entry = _stat_entry(id, path)
+            ob = _create_ob(id, path, self._type_map, 
+                self._getCache('object'), entry)
+        _set_timestamp(ob, entry.mtime)
         ob._p_jar = self._p_jar
         return ob.__of__(self) # TODO what's this?
                     
@@ -731,7 +1882,7 @@ class LocalDirectory(
     def _safe_setOb(self, id, ob):
         try: self._setOb(id, ob)
         except EnvironmentError as err: 
-            if (err[0] == errno.EACCES):
+            if (err.errno == errno.EACCES):
                 raise Forbidden(HTTPResponse()._error_html(
                     'Forbidden',
                     "Sorry, you do not have permission to write "
@@ -742,11 +1893,13 @@ class LocalDirectory(
         if not hasattr(ob, 'meta_type'):
             raise BadRequest('Unknown object type.')
         path = self._getpath(id)
-        try: _save_ob(ob, path)
+        try: _save_ob(ob, path, self._getRoot().fsync_writes)
         except TypeError:
             raise BadRequest(
                 "Cannot add objects of type '%s' to local directories."
                 % ob.meta_type)
+        finally:
+            self._invalidate()
 
     def _delOb(self, id):
         path = self._getpath(id)
@@ -758,7 +1911,7 @@ class LocalDirectory(
                 t = 'file'
                 os.unlink(path)
         except EnvironmentError as err:
-            if (err[0] == errno.EACCES):
+            if (err.errno == errno.EACCES):
                 if t == 'directory' and os.listdir(path):
                     raise DeleteError(HTTPResponse()._error_html(
                         'DeleteError',
@@ -769,6 +1922,7 @@ class LocalDirectory(
                         "Sorry, you do not have permission to delete " \
                         "the requested %s ('%s')." % (t, id)))
             else: raise
+        self._invalidate()
 
     def _copyOb(self, id, ob):
         self._setObject(id, ob)
@@ -777,39 +1931,221 @@ class LocalDirectory(
         src = ob._local_path
         dest = self._getpath(id)
         try: 
-            os.rename(src, dest)
+            _move_path(src, dest, self._getRoot().fsync_writes)
         except EnvironmentError as err: 
-            if (err[0] == errno.EACCES):
+            if (err.errno == errno.EACCES):
                 raise Forbidden(HTTPResponse()._error_html(
                     'Forbidden',
                     "Sorry, you do not have permission to write "
                     "to this directory.<p>"))
             else: raise
+        finally:
+            _invalidate_stats()
+        self._invalidate()
+        self._invalidate(os.path.dirname(src))
+
+    def _copyPath(self, id, src):
+        """Copy the file or directory 'src' to 'id' in this directory on
+        the file system, without building an object from it."""
+        self._checkId(id)
+        try:
+            _copy_path(src, self._getpath(id), 
+                self._getRoot().fsync_writes)
+        except EnvironmentError as err: 
+            if (err.errno == errno.EACCES):
+                raise Forbidden(HTTPResponse()._error_html(
+                    'Forbidden',
+                    "Sorry, you do not have permission to write "
+                    "to this directory.<p>"))
+            else: raise
+        finally:
+            _invalidate_stats()
+        self._invalidate()
         
     def _verifyObjectPaste(self, ob, REQUEST):
         pass
             
-    def _write_file(self, pfile, path):
+    def _putFile(self, id, REQUEST):
+        """Replace or create the file 'id' with the body of the PUT request
+        'REQUEST' and return true. A request with a Content-Range header
+        writes a part of the file, and false is returned while the file 
+        is not complete."""
+        self._checkId(id, 1)
+        content_range = REQUEST.get_header('Content-Range', None)
+        if content_range is not None:
+            return self._putRange(id, REQUEST, content_range)
+        body, size = _request_body(REQUEST)
+        self._write_file(body, self._getpath(id), size)
+        self._invalidate()
+        return 1
+
+    def _putRange(self, id, REQUEST, content_range):
+        """Write the body of a PUT request with a Content-Range header to
+        the upload session of the file 'id'. The file is created when its
+        last byte is received; until then the response is a 308 with the
+        range that was received so far. A 'bytes */total' range with an
+        empty body asks for that range."""
+        m = _content_range(content_range.strip())
+        if m is None:
+            raise BadRequest('Invalid Content-Range %s' % content_range)
+        first, last, total = m.groups()
+        if total == '*':
+            total = None
+        else:
+            total = int(total)
+        path = self._getpath(id)
+        staging = self._getStaging()
+        token = staging.tokenFor(path)
         try:
-            if isinstance(pfile, str):
-                outfile=open(path,'wb')
-                outfile.write(pfile)
-                outfile.close()
+            if first is None:
+                offset = staging.exists(token) and staging.offset(token) or 0
             else:
-                blocksize=8*1024
-                outfile=open(path,'wb')
-                data=pfile.read(blocksize)
-                while data:
-                    outfile.write(data)
-                    data=pfile.read(blocksize)
-                outfile.close()
+                first, last = int(first), int(last)
+                if last < first or (total is not None and last >= total):
+                    raise BadRequest('Invalid Content-Range %s' % 
+                        content_range)
+                body, size = _request_body(REQUEST)
+                if size >= 0 and size != last - first + 1:
+                    raise BadRequest('The body does not match the '
+                        'Content-Range %s' % content_range)
+                if first == 0 or not staging.exists(token):
+                    staging.collect(self._getRoot().upload_max_age)
+                    staging.start(path, total, token=token)
+                offset = staging.append(token, first, body, last - first + 1)
+        except ValueError as err:
+            raise BadRequest(str(err))
+        if total is not None and offset == total:
+            self._finishUpload(staging, token, path)
+            return 1
+        RESPONSE = REQUEST.RESPONSE
+        RESPONSE.setStatus(308)
+        if offset:
+            RESPONSE.setHeader('Range', 'bytes=0-%d' % (offset - 1))
+        return 0
+
+    def _getStaging(self):
+        """Return the staging directory of chunked uploads."""
+        root = self._getRoot()
+        return getStaging(os.path.join(root.basepath, _staging_name))
+
+    def _getSession(self, staging, token):
+        """Return the settings of the upload session 'token', which must
+        upload a file to this directory."""
+        try:
+            settings = staging.settings(token)
+        except ValueError as err:
+            raise BadRequest(str(err))
+        target = settings['target']
+        if self._getpath(os.path.basename(target)) != target:
+            raise BadRequest('Unknown upload %s' % token)
+        return settings
+
+    def _finishUpload(self, staging, token, path):
+        """Verify the upload session 'token' and move its data to the 
+        file 'path'."""
+        fsync = self._getRoot().fsync_writes
+        try:
+            part, settings = staging.finish(token, fsync)
+        except ValueError as err:
+            raise BadRequest(str(err))
+        try:
+            _rename_atomic(part, path, fsync)
         except EnvironmentError as err: 
-            if (err[0] == errno.EACCES):
+            if (err.errno == errno.EACCES):
                 raise Forbidden(HTTPResponse()._error_html(
                     'Forbidden',
                     "Sorry, you do not have permission to write "
                     "to this directory.<p>"))
             else: raise
+        finally:
+            _invalidate_stats()
+        staging.remove(token)
+        self._invalidate()
+
+    def manage_uploadStart(self, id, size=None, checksum=None, REQUEST=None):
+        """Start a chunked upload of the file 'id' and return the token
+        of the upload session. 'size' is the size of the file and 
+        'checksum' is an 'algorithm:hexdigest' string such as 
+        'sha256:...', if they are known. The data is sent with 
+        manage_uploadChunk and the file is created by 
+        manage_uploadFinish."""
+        self._checkId(id, 1)
+        path = self._getpath(id)
+        if os.path.exists(path):
+            self._checkOverwrite(REQUEST)
+        if size == '':
+            size = None
+        staging = self._getStaging()
+        staging.collect(self._getRoot().upload_max_age)
+        try:
+            return staging.start(path, size, checksum)
+        except ValueError as err:
+            raise BadRequest(str(err))
+
+    def manage_uploadChunk(self, token, offset, data=None, REQUEST=None):
+        """Write a chunk of the upload session 'token' at 'offset' and 
+        return the number of bytes received. 'data' is a string or a 
+        FileUpload; without it the body of the request is written. Any
+        data after 'offset' is dropped, so the chunk of an interrupted
+        request can be sent again."""
+        staging = self._getStaging()
+        self._getSession(staging, token)
+        size = None
+        if data is None:
+            if REQUEST is None:
+                raise BadRequest('No data')
+            data, size = _request_body(REQUEST)
+            if size < 0:
+                size = None
+        try:
+            return staging.append(token, offset, data, size)
+        except ValueError as err:
+            raise BadRequest(str(err))
+
+    def manage_uploadStatus(self, token):
+        """Return the number of bytes received by the upload session 
+        'token'. An interrupted upload is resumed at this offset."""
+        staging = self._getStaging()
+        self._getSession(staging, token)
+        try:
+            return staging.offset(token)
+        except ValueError as err:
+            raise BadRequest(str(err))
+
+    def manage_uploadFinish(self, token, REQUEST=None):
+        """Create the file of the upload session 'token' and return its
+        id. The size and the checksum of the data are verified first."""
+        staging = self._getStaging()
+        path = self._getSession(staging, token)['target']
+        if os.path.exists(path):
+            self._checkOverwrite(REQUEST)
+        self._finishUpload(staging, token, path)
+        return os.path.basename(path)
+
+    def manage_uploadAbort(self, token):
+        """Remove the upload session 'token' and its data."""
+        staging = self._getStaging()
+        self._getSession(staging, token)
+        staging.remove(token)
+        
+    def _write_file(self, pfile, path, size=None):
+        """Replace the file 'path' with the data of 'pfile' (a string or 
+        a file object such as a FileUpload). 'size' is the size of the 
+        data in 'pfile' if it is known."""
+        try:
+            if hasattr(pfile, 'seek'):
+                pfile.seek(0)
+            _write_atomic(path, pfile, self._getRoot().fsync_writes, 
+                size)
+        except EnvironmentError as err: 
+            if (err.errno == errno.EACCES):
+                raise Forbidden(HTTPResponse()._error_html(
+                    'Forbidden',
+                    "Sorry, you do not have permission to write "
+                    "to this directory.<p>"))
+            else: raise
+        finally:
+            _invalidate_stats()
 
     def manage_createDirectory(self, path, action='manage_workspace', REQUEST=None):
         """Create a new directory relative to this directory."""
@@ -827,12 +2163,13 @@ class LocalDirectory(
             try:
                 os.makedirs(fullpath)
             except EnvironmentError as err: 
-                if (err[0] == errno.EACCES):
+                if (err.errno == errno.EACCES):
                     raise Forbidden(HTTPResponse()._error_html(
                         'Forbidden',
                         "Sorry, you do not have permission to write "
                         "to this directory.<p>"))
                 else: raise
+            self._invalidate()
             if REQUEST:
                 return MessageDialog(
                         title='Success!',
@@ -878,6 +2215,7 @@ class LocalDirectory(
             self.manage_overwrite(file, path, REQUEST)
         else:
             self._write_file(file, path)
+        self._invalidate()
         if REQUEST: 
             if action == 'index_fs':
                 # do not show a MessageDialog if called from PloneLocalFS
@@ -890,6 +2228,11 @@ class LocalDirectory(
     
     def manage_overwrite(self, file, path, REQUEST=None):
         """Overwrite a local file."""
+        self._checkOverwrite(REQUEST)
+        self._write_file(file, path)
+
+    def _checkOverwrite(self, REQUEST=None):
+        """Raise Unauthorized unless the user may overwrite files."""
         if REQUEST is None and hasattr(self, 'aq_acquire'):
             try: 
                 REQUEST = self.aq_acquire('REQUEST')
@@ -902,7 +2245,6 @@ class LocalDirectory(
             raise Unauthorized(HTTPResponse()._error_html(
                     'Unauthorized',
                     "Sorry, you are not authorized to overwrite files.<p>"))
-        self._write_file(file, path)
     
     def manage_renameObject(self, id, new_id, REQUEST=None):
         """Rename a file or subdirectory."""
@@ -918,7 +2260,7 @@ class LocalDirectory(
         try:
             os.rename(f, t)
         except EnvironmentError as err:
-            if (err[0] == errno.EACCES):
+            if (err.errno == errno.EACCES):
                 if os.path.isdir(f):
                     t = 'directory'
                 else:
@@ -928,6 +2270,7 @@ class LocalDirectory(
                     "Sorry, you do not have permission to rename " \
                     "the requested %s ('%s')." % (t, id)))
             else: raise
+        self._invalidate()
         if REQUEST is not None:
             return self.manage_main(self, REQUEST, update_menu=1)
 
@@ -986,20 +2329,32 @@ class LocalDirectory(
         oblist = []
         m = FileMoniker()
         op = cp[0]
-        for ids in cp[1]:
-            m.ids = ids
-            try:
-                ob = m.bind(self.root or self)
-            except:
-                raise CopyError(eNotFound)
-            self._verifyObjectPaste(ob, REQUEST)
-            oblist.append(ob)
+        if op == 0:
+            # Copies are made on the file system, the files are not bound
+            for ids in cp[1]:
+                m.ids = ids
+                src = m.path(self._getRoot())
+                if src is None or not os.path.exists(src):
+                    raise CopyError(eNotFound)
+                if os.path.isdir(src) and (self.basepath + os.sep)[
+                        :len(src) + 1] == src + os.sep:
+                    raise CopyError('This object cannot be pasted into itself')
+                oblist.append((ids[-1], src))
+        else:
+            for ids in cp[1]:
+                m.ids = ids
+                try:
+                    ob = m.bind(self._getRoot())
+                except:
+                    raise CopyError(eNotFound)
+                self._verifyObjectPaste(ob, REQUEST)
+                oblist.append(ob)
 
         if op == 0:
             # Copy operation
-            for ob in oblist:
-                id = self._get_id(absattr(ob.id))
-                self._copyOb(id, ob)
+            for id, src in oblist:
+                id = self._get_id(id)
+                self._copyPath(id, src)
 
             if REQUEST is not None:
                 return self.manage_main(self, REQUEST, update_menu=1,
@@ -1056,43 +2411,157 @@ class LocalDirectory(
             spec = self.file_filter
         return self._ids(spec)
     
-    def fileValues(self, spec=None, propagate=1):
+    def _walk(self, spec=None, prune=None):
+        """Generate (relative path, directories, files) for the tree below
+        this directory, skipping directories whose names match the glob
+        patterns 'prune'."""
+        if spec is None:
+            spec = self.file_filter
+        pruned = _compile_patterns(_spec_key(prune))
+        workers = max(getattr(self._getRoot(), 'walk_workers', 1), 1)
+        for rel, dirs, files in _walk(self.basepath, _get_filter(spec), 
+                                      workers):
+            if pruned is not None:
+                dirs[:] = [e for e in dirs if not pruned(e.name)]
+            yield rel, dirs, files
+
+    def walk(self, spec=None, prune=None):
+        """Generate a (path, dirnames, filenames) tuple for this directory
+        and each directory below it, in sorted depth first order. The 
+        path is relative to this directory and uses '/' as separator. 
+        Only names that pass 'spec' (default: the file filter) are 
+        included. Directories whose names match the glob patterns 
+        'prune', or that are removed from 'dirnames' by the caller, are
+        not visited."""
+        for rel, dirs, files in self._walk(spec, prune):
+            dirnames = [e.name for e in dirs]
+            yield rel, dirnames, [e.name for e in files]
+            keep = set(dirnames)
+            dirs[:] = [e for e in dirs if e.name in keep]
+
+    def find(self, name=None, type=None, min_size=None, max_size=None,
+             newer=None, older=None, prune=None, spec=None):
+        """Generate the paths, relative to this directory, of the files and
+        directories below it that match all given criteria:
+
+        name -- glob patterns matched against the name
+        type -- 'file' or 'directory'
+        min_size, max_size -- bounds of the size of files in bytes
+        newer, older -- bounds of the modification time (DateTime or 
+          seconds since the epoch)
+
+        'prune' and 'spec' are used as in walk."""
+        if type not in (None, 'file', 'directory'):
+            raise BadRequest('Invalid type %s' % repr(type))
+        match = _compile_patterns(_spec_key(name))
+        min_size, max_size, newer, older = _query_params(
+            min_size, max_size, newer, older)
+        sized = min_size is not None or max_size is not None
+        for rel, dirs, files in self._walk(spec, prune):
+            prefix = rel and rel + '/' or ''
+            for e in sorted(dirs + files):
+                if type is not None and (type == 'directory') != e.isdir:
+                    continue
+                if match is not None and not match(e.name):
+                    continue
+                if sized:
+                    if e.isdir or e.size < 0: 
+                        continue
+                    if min_size is not None and e.size < min_size:
+                        continue
+                    if max_size is not None and e.size > max_size:
+                        continue
+                if newer is not None or older is not None:
+                    if e.mtime is None:
+                        continue
+                    if newer is not None and e.mtime <= newer:
+                        continue
+                    if older is not None and e.mtime >= older:
+                        continue
+                yield prefix + e.name
+
+    def fileCount(self, spec=None):
+        """Return the number of files and subdirectories.
+        If 'spec' is specified, count only those whose filename 
+        matches 'spec'."""
+        if spec is None:
+            spec = self.file_filter
+        return len(self._entries(spec))
+
+    def manage_batchStart(self, b_start=0):
+        """Return the b_start parameter of the Contents view as an 
+        integer. Invalid values are a bad request."""
+        return _batch_params(0, b_start, None)[1]
+
+    def _fileEntries(self, spec, sort_on, reverse, b_start, b_size):
+        """Return the entries of one page of the listing."""
+        entries = self._entries(spec)
+        if sort_on is None:
+            b_start = max(int(b_start or 0), 0)
+            if b_size is None:
+                return entries[b_start:]
+            return entries[b_start:b_start + max(int(b_size), 0)]
+        return _sort_entries(entries, sort_on, reverse, b_start, b_size, 
+            self._type_map)
+    
+    def listing_json(self, spec=None, sort_on='id', reverse=0, b_start=0,
+                     b_size=None, REQUEST=None):
+        """Return the listing of this directory as a JSON array of 
+        objects with the keys name, type, size, mtime and is_dir. The 
+        parameters are those of fileValues. The response carries an 
+        ETag made from the state of the directory and the parameters, 
+        and conditional requests for an unchanged listing return 304."""
+        if spec is None:
+            spec = self.file_filter
+        reverse, b_start, b_size = _batch_params(reverse, b_start, b_size)
+        path = os.path.normpath(self.basepath)
+        st = _stat(path)
+        params = repr((_spec_key(spec), sort_on, reverse, b_start, b_size))
+        etag = '"%x-%x-%x"' % (st.st_mtime_ns, st.st_ctime_ns, 
+            zlib.crc32(params.encode('utf-8')))
+        if REQUEST is not None:
+            RESPONSE = REQUEST.RESPONSE
+            RESPONSE.setHeader('ETag', etag)
+            RESPONSE.setHeader('Last-Modified', rfc1123_date(st.st_mtime))
+            if not_modified(REQUEST, etag, st.st_mtime):
+                RESPONSE.setStatus(304)
+                return b''
+            RESPONSE.setHeader('Content-Type', 
+                'application/json; charset=utf-8')
+        entries = self._fileEntries(spec, sort_on, reverse, b_start, b_size)
+        return json_listing_iterator(entries, self.basepath, self._type_map)
+    
+    def fileValues(self, spec=None, propagate=1, sort_on='id', reverse=0,
+                   b_start=0, b_size=None):
         """Return a list of Local File objects.
         If 'spec' is specified, return only objects whose filename 
-        matches 'spec'."""
+        matches 'spec'. Directories come first, each group sorted on 
+        'sort_on' ('id', 'size', 'mtime' or 'type'). If 'b_size' is 
+        given, return only 'b_size' objects starting at 'b_start'."""
         if spec is None:
             spec = self.file_filter	
-        r = []
-        a = r.append
+        reverse, b_start, b_size = _batch_params(reverse, b_start, b_size)
         g = self._getfileob
-        if propagate:
-            for id in self._ids(spec): a(g(id, spec))
-        else:
-            for id in self._ids(spec): a(g(id))
-        #sort that directories come first
-        res = []
-        for v in r:
-            s = '%s%s' %((v.type!='directory'),v.id)
-            res.append((s,v))
-        res.sort()    
-        
-        return [ x[1] for x in res ]
+        s = spec
+        if not propagate: s = None
+        return [g(e.name, s, e) for e in 
+                self._fileEntries(spec, sort_on, reverse, b_start, b_size)]
 
-    def fileItems(self, spec=None, propagate=1):
+    def fileItems(self, spec=None, propagate=1, sort_on=None, reverse=0,
+                  b_start=0, b_size=None):
         """Return a list of (id, fileobject) tuples.
         If 'spec' is specified, return only objects whose filename 
-        matches 'spec'
+        matches 'spec'. The tuples are ordered by id, unless 'sort_on' 
+        is given, and paged like those of fileValues.
         """
         if spec is None:
             spec=self.file_filter
-        r = []
-        a = r.append
+        reverse, b_start, b_size = _batch_params(reverse, b_start, b_size)
         g = self._getfileob
-        if propagate:
-            for id in self._ids(spec): a((id, g(id, spec)))
-        else:
-            for id in self._ids(spec): a((id, g(id)))
-        return r
+        s = spec
+        if not propagate: s = None
+        return [(e.name, g(e.name, s, e)) for e in 
+                self._fileEntries(spec, sort_on, reverse, b_start, b_size)]
 
     def objectIds(self, spec=None):
         """Return a list of subobject ids.
@@ -1125,64 +2594,280 @@ class LocalDirectory(
             return self._objectItems(spec)
         return ()
     
-    def _objectIds(self, spec=None):
-        g = self._safe_getOb
-        ids = self._ids()
-        if spec is not None:
-            if type(spec) == type('s'):
-                spec = [spec]
-            r = []
-            a = r.append
-            for id in ids:
-                ob = g(id)
-                if ob.meta_type in spec:
-                    r.append(id)
-            return r
-        return ids
-        
-    def _objectValues(self, spec=None):
+    def _specEntries(self, spec):
+        """Return (entry, ob) tuples for the entries whose meta_type is in
+        'spec'. 'ob' is the object of the entry if it had to be built to
+        find its meta_type, otherwise None."""
+        if type(spec) == type('s'):
+            spec = [spec]
+        _type_map = self._type_map
+        meta_types = None
         r = []
         a = r.append
-        g = self._safe_getOb
-        if spec is not None:
-            if type(spec) == type('s'):
-                spec = [spec]
-            for id in self._ids(): 
-                ob = g(id)
+        for e in self._entries():
+            meta_type = _entry_meta_type(e, _type_map)
+            if meta_type is None:
+                # Made by a factory, try the metadata index
+                if meta_types is None:
+                    meta_types = self._indexedMetaTypes() or {}
+                meta_type = meta_types.get(e.name)
+            if meta_type is not None:
+                if meta_type in spec:
+                    a((e, None))
+            else:
+                ob = self._getEntryOb(e)
                 if ob.meta_type in spec:
-                    a(g(id))
-        else:
-            for id in self._ids(): a(g(id))
+                    a((e, ob))
         return r
 
+    def _objectIds(self, spec=None):
+        if spec is not None:
+            return [e.name for e, ob in self._specEntries(spec)]
+        return [e.name for e in self._entries()]
+        
+    def _objectValues(self, spec=None):
+        return [ob for id, ob in self._objectItems(spec)]
+
     def _objectItems(self, spec=None):
         r = []
         a = r.append
-        g = self._safe_getOb
+        g = self._getEntryOb
         if spec is not None:
-            if type(spec) == type('s'):
-                spec = [spec]
-            for id in self._ids(): 
-                ob = g(id)
-                if ob.meta_type in spec:
-                    a((id, g(id)))
+            for e, ob in self._specEntries(spec):
+                if ob is None:
+                    ob = g(e)
+                a((e.name, ob))
         else:
-            for id in self._ids(): a((id, g(id)))
+            for e in self._entries(): a((e.name, g(e)))
         return r
     
+    #
+    # Metadata index
+    #
+
+    def _relpath(self):
+        """Return the path of this directory relative to the LocalFS, 
+        with '/' as separator."""
+        root = self._getRoot()
+        rel = os.path.relpath(self.basepath, root.basepath)
+        if rel == os.curdir:
+            return ''
+        return rel.replace(os.sep, '/')
+
+    def _getIndex(self):
+        """Return the metadata index of the LocalFS or None if it is not 
+        enabled. The index is cleared when the type map changes."""
+        root = self._getRoot()
+        if not getattr(root, 'index_enabled', 0):
+            return None
+        index = getIndex(getattr(root, 'index_path', '') or 
+                         os.path.join(root.basepath, _index_name))
+        sig = '%x' % zlib.crc32(
+            repr(sorted(self._type_map.items())).encode('utf-8'))
+        if index.getMeta('type_map') != sig:
+            index.clear()
+            index.setMeta('type_map', sig)
+        return index
+
+    def _entryMetaType(self, e, path):
+        """Return the meta_type of the object of the entry 'e'."""
+        meta_type = _entry_meta_type(e, self._type_map)
+        if meta_type is not None:
+            return meta_type
+        try:
+            return _create_ob(e.name, path, self._type_map, 
+                self._getCache('object'), e).meta_type
+        except ConflictError:
+            raise
+        except Exception:
+            return None
+
+    def _indexDir(self, index, dir, path, force=0):
+        """Bring the index of the directory 'path' (indexed as 'dir') up to
+        date and return its mapping of names to rows. Unless 'force' is
+        true, the index is used as it is while the directory is unchanged.
+        Only new and changed entries are examined."""
+        st = os.stat(path)
+        state = (st.st_mtime_ns, st.st_ctime_ns)
+        if not force and index.dirState(dir) == state:
+            return index.dirRows(dir)
+        old = index.dirRows(dir)
+        rows = {}
+        for e in _scandir(path):
+            if not valid_id(e.name):
+                continue
+            row = old.get(e.name)
+            if row is None or row[:3] != (e.isdir, e.size, e.mtime):
+                filepath = os.path.join(path, e.name)
+                row = (e.isdir, e.size, e.mtime, 
+                    _entry_content_type(e, filepath, self._type_map),
+                    self._entryMetaType(e, filepath))
+            rows[e.name] = row
+        index.updateDir(dir, state, 
+            [(name,) + row for name, row in rows.items()])
+        return rows
+
+    def _indexedMetaTypes(self):
+        """Return a mapping of names to meta types for this directory from
+        the metadata index, or None if there is no index."""
+        index = self._getIndex()
+        if index is None:
+            return None
+        try:
+            rows = self._indexDir(index, self._relpath(), 
+                os.path.normpath(self.basepath))
+        except Exception:
+            return None
+        r = {}
+        for name, row in rows.items():
+            if row[4] is not None:
+                r[name] = row[4]
+        return r
+
+    def queryFiles(self, name=None, content_type=None, meta_type=None, 
+                   type=None, min_size=None, max_size=None, newer=None, 
+                   older=None, sort_on='path', reverse=0, limit=None):
+        """Return a list of mappings describing the files and directories 
+        below this directory that match all given criteria, as found in 
+        the metadata index. The mappings have the keys path (relative to 
+        this directory), name, is_dir, size, mtime, content_type and 
+        meta_type.
+
+        name, content_type -- glob patterns
+        meta_type -- a meta type or a list of meta types
+        type -- 'file' or 'directory'
+        min_size, max_size -- bounds of the size in bytes
+        newer, older -- bounds of the modification time (DateTime or 
+          seconds since the epoch)
+        sort_on -- 'path', 'name', 'size', 'mtime', 'content_type' or 
+          'meta_type'
+
+        The index is as current as its last refresh, see 
+        manage_refreshIndex."""
+        index = self._getIndex()
+        if index is None:
+            raise BadRequest('The metadata index is not enabled.')
+        if type not in (None, 'file', 'directory'):
+            raise BadRequest('Invalid type %s' % repr(type))
+        is_dir = None
+        if type is not None:
+            is_dir = type == 'directory'
+        min_size, max_size, newer, older = _query_params(
+            min_size, max_size, newer, older)
+        reverse, b_start, limit = _batch_params(reverse, 0, limit)
+        dir = self._relpath()
+        skip = dir and len(dir) + 1 or 0
+        match = _get_filter(self.file_filter)
+        filter = None
+        if match is not None:
+            # Filtered in the query, so that the limit counts the files
+            # that pass the file filter
+            def filter(row):
+                path = row['dir'] and row['dir'] + '/' or ''
+                parts = (path + row['name'])[skip:].split('/')
+                if not match(parts[-1], row['is_dir']):
+                    return 0
+                for p in parts[:-1]:
+                    if not match(p, 1):
+                        return 0
+                return 1
+        try:
+            rows = index.query(dir, name, content_type, meta_type, is_dir,
+                min_size, max_size, newer, older, sort_on, reverse, limit,
+                filter)
+        except ValueError as err:
+            raise BadRequest(str(err))
+        for row in rows:
+            path = row.pop('dir')
+            path = (path and path + '/' or '') + row['name']
+            row['path'] = path[skip:]
+            row['is_dir'] = bool(row['is_dir'])
+        return rows
+
+    def manage_refreshIndex(self, REQUEST=None):
+        """Bring the metadata index of this directory and the directories 
+        below it up to date."""
+        index = self._getIndex()
+        if index is None:
+            raise BadRequest('The metadata index is not enabled.')
+        stack = [(self._relpath(), os.path.normpath(self.basepath))]
+        count = 0
+        while stack:
+            dir, path = stack.pop()
+            try:
+                rows = self._indexDir(index, dir, path, 1)
+            except OSError:
+                index.removeTree(dir)
+                continue
+            count = count + 1
+            prefix = dir and dir + '/' or ''
+            for name in sorted(rows.keys(), reverse=True):
+                if rows[name][0]:
+                    stack.append((prefix + name, os.path.join(path, name)))
+        if REQUEST is not None:
+            return MessageDialog(
+                title='Index refreshed',
+                message='%d directories have been indexed.' % count,
+                action='manage_main')
+        return count
+
+    def _subdirs(self, first=0):
+        """Return the sorted names of the subdirectories of this directory.
+        The names are cached while the mtime and ctime of the directory 
+        are unchanged. If 'first' is true and the names are not cached,
+        only the name of the first subdirectory found is returned."""
+        path = os.path.normpath(self.basepath)
+        st = _stat(path)
+        sig = (st.st_mtime_ns, st.st_ctime_ns, _spec_key(self.file_filter))
+        cache = self._getCache('tree')
+        cached = cache.get(path, check=lambda c: c[0] == sig)
+        if cached is None:
+            if first:
+                return _scan_subdirs(path, _get_filter(self.file_filter), 1)
+            names = _scan_subdirs(path, _get_filter(self.file_filter))
+            cached = (sig, names)
+            cache.set(path, cached)
+        return cached[1]
+
     def tpValues(self):
-        """Returns a list of the folder's sub-folders, used by tree tag."""
+        """Returns the folder's sub-folders, used by tree tag. The tree tag
+        only tests the sub-folders of a collapsed folder for truth, which
+        is answered by tpHasChildren; the subdirectories are listed when
+        the folder is expanded."""
+        return _tree_branches(self)
+
+    def _tpItems(self):
+        """Return the list of subdirectory objects of this directory. The
+        subdirectories are found without building or stat'ing the files 
+        of the directory."""
         r = []
+        # Subdirectories are folderish only if the tree view is enabled
+        if not self.tree_view:
+            return r
         try:
-            for id in self._ids():
-                o = self._safe_getOb(id)
-                try: 
-                    if o.isPrincipiaFolderish: r.append(o)
-                except: pass
-        except: pass
+            names = self._subdirs()
+        except OSError: 
+            return r
+        root = self._getRoot()
+        for id in names:
+            ob = LocalDirectory(id, self._getpath(id), root, self.tree_view,
+                self.catalog, self._type_map, self._icon_map)
+            ob._p_jar = self._p_jar
+            r.append(ob.__of__(self))
         return r
 
-    def tpId(self): return encode_str(self.serverPath())
+    def tpHasChildren(self):
+        """Return true if the tree view can expand this directory. The
+        directory is scanned only up to its first subdirectory."""
+        if not self.tree_view:
+            return 0
+        try:
+            return len(self._subdirs(first=1)) > 0
+        except OSError: 
+            return 0
+
+    def tpId(self):
+        return encode_str(self.serverPath().encode('utf-8')).decode('ascii')
     
     def serverPath(self):
         """Return the full path of the directory object relative to the
@@ -1219,7 +2904,7 @@ class LocalDirectory(
             files = self.default_document.split()
             for file in files:
                 path = self._getpath(file)
-                if os.path.isfile(path):
+                if _isfile(path):
                     try:
                         return self._safe_getOb(file)
                     except Forbidden: pass
@@ -1228,7 +2913,7 @@ class LocalDirectory(
         return None
                 
     def bobobase_modification_time(self):
-        t = os.stat(self._local_path)[stat.ST_MTIME]
+        t = _stat(self._local_path)[stat.ST_MTIME]
         return DateTime(t)
 
     #
@@ -1283,6 +2968,54 @@ class LocalDirectory(
         return marshal.dumps((mode, 0, 0, 1, owner, group, 0, mtime, mtime, mtime))
 
 
+class _lazy:
+    """Attribute computed by the method 'method' on first access and 
+    then stored in the instance dictionary, which hides the descriptor 
+    from further lookups."""
+
+    def __init__(self, name, method):
+        self.name = name
+        self.method = method
+
+    def __get__(self, inst, cls=None):
+        if inst is None:
+            return self
+        value = getattr(inst, self.method)()
+        inst.__dict__[self.name] = value
+        return value
+
+
+class _tree_branches:
+    """The subdirectories of a directory for the tree tag. Testing them
+    for truth calls tpHasChildren; they are listed on first use as a
+    sequence."""
+
+    __allow_access_to_unprotected_subobjects__ = 1
+
+    def __init__(self, dir):
+        self._dir = dir
+        self._items = None
+
+    def _values(self):
+        if self._items is None:
+            self._items = self._dir._tpItems()
+        return self._items
+
+    def __bool__(self):
+        if self._items is not None:
+            return len(self._items) > 0
+        return bool(self._dir.tpHasChildren())
+
+    def __len__(self):
+        return len(self._values())
+
+    def __getitem__(self, i):
+        return self._values()[i]
+
+    def __iter__(self):
+        return iter(self._values())
+
+
 class LocalFile(OFS.SimpleItem.Item, Acquisition.Implicit):
 
     """Object representing a file in the local file system."""
@@ -1294,19 +3027,26 @@ class LocalFile(OFS.SimpleItem.Item, Acquisition.Implicit):
     security.declareProtected('FTP access', 'manage_FTPstat', 'manage_FTPget',
         'manage_FTPlist', 'PUT', 'manage_FTPput')  # sbk
     
-    def __init__(self, parent, id, path, spec):
+    def __init__(self, parent, id, path, spec, entry=None):
         """LocalFile __init__"""
         self.parent = parent
         self.id = id
         self.path = path
-        self.type = self._getType()
-        self.url = self._getURL(spec)
-        self.plain_url = self._getPlainURL()
-        self.icon = self._getIcon()
-        self.size = self._getSize()
-        self.mtime = self._getTime()
-        self.display_size = self._getDisplaySize()
-        self.display_mtime = self._getDisplayTime()
+        if entry is None:
+            entry = _stat_entry(id, path)
+        self._entry = entry
+        self._spec = spec
+
+    # The display attributes are computed when they are first used, 
+    # so listings only pay for the attributes they show.
+    type = _lazy('type', '_getType')
+    url = _lazy('url', '_getURL')
+    plain_url = _lazy('plain_url', '_getPlainURL')
+    icon = _lazy('icon', '_getIcon')
+    size = _lazy('size', '_getSize')
+    mtime = _lazy('mtime', '_getTime')
+    display_size = _lazy('display_size', '_getDisplaySize')
+    display_mtime = _lazy('display_mtime', '_getDisplayTime')
 
     def getDefaultDocumentPath(self, target, default=''):
         """Return true if is Directory and has default doc"""
@@ -1318,7 +3058,7 @@ class LocalFile(OFS.SimpleItem.Item, Acquisition.Implicit):
             default_documents = default_documents.split(' ')
         for file in default_documents:
             path = os.path.join(self.path, file)
-            if (os.path.isfile(path)):
+            if _isfile(path):
                 return os.path.join(target, file)
         return os.path.join(target, default)
 
@@ -1334,8 +3074,9 @@ class LocalFile(OFS.SimpleItem.Item, Acquisition.Implicit):
         """bobobase_modification_time"""
         return self.mtime
 
-    def _getURL(self, spec):
+    def _getURL(self):
         """_getURL"""
+        spec = self._spec
         url = quote(self.id)
         if (self.type == 'directory') and (spec is not None):
             if (type(spec) is type('')):
@@ -1353,21 +3094,8 @@ class LocalFile(OFS.SimpleItem.Item, Acquisition.Implicit):
         
     def _getType(self):
         """Return the content type of a file."""
-        name = self.id
-        path = self.path
-        if (os.path.isdir(path)): return 'directory'
-        ext = os.path.splitext(name)[-1]
-        t, c = _get_content_type(ext, self.parent._type_map)
-        if t: return t
-        try:
-            f = open(path, 'rb')
-            data = f.read(_test_read)
-            f.close()
-            ob = OFS.Image.File(name, name, data)
-            _set_content_type(ob, t, data)
-            return ob.content_type
-        except EnvironmentError:
-            return 'application/octet-stream'
+        return _entry_content_type(self._entry, self.path, 
+            self.parent._type_map)
 
     def _getIcon(self):
         """Return the path of the icon associated with this file type."""
@@ -1387,13 +3115,7 @@ class LocalFile(OFS.SimpleItem.Item, Acquisition.Implicit):
     def _getSize(self):
         """Return the size of the specified file or -1 if an error occurs.
         Return None if the path refers to a directory."""
-        path = self.path
-        if (os.path.isdir(path)):
-            return None
-        try:
-            return os.stat(path)[stat.ST_SIZE]
-        except:
-            return -1
+        return self._entry.size
 
     def _getDisplaySize(self):
         """Return the size of a file or directory formatted for display."""
@@ -1416,10 +3138,9 @@ class LocalFile(OFS.SimpleItem.Item, Acquisition.Implicit):
     def _getTime(self):
         """Return the last modified time of a file or directory
         or None if an error occurs."""
-        try:
-            return DateTime(os.stat(self.path)[stat.ST_MTIME])
-        except:
-            pass
+        mtime = self._entry.mtime
+        if mtime is not None:
+            return DateTime(mtime)
 
     def _getDisplayTime(self):
         """Return the last modified time of a file or directory formatted 
@@ -1435,12 +3156,7 @@ class LocalFile(OFS.SimpleItem.Item, Acquisition.Implicit):
     
     def PUT(self, REQUEST, RESPONSE):
         """ Handle HTTP PUT requests """
-        self.dav__init(REQUEST, RESPONSE)
-        self.dav__simpleifhandler(REQUEST, RESPONSE, refresh=1)
-        self.write(REQUEST.get('BODY', ''))
-        self.ZCacheable_invalidate()
-        RESPONSE.setStatus(204)
-        return RESPONSE
+        return self.getObject().PUT(REQUEST, RESPONSE)
 
     manage_FTPput = PUT
 
@@ -1453,16 +3169,147 @@ class LocalFile(OFS.SimpleItem.Item, Acquisition.Implicit):
 
     def manage_FTPstat(self,REQUEST):
         """Pseudo stat used for FTP listings"""
-        size = self._getSize()
+        size = self.size
         mode = 0o100000 | 0o660
         if self.type == 'directory':
             size = 0
             mode = 0o040000 | 0o770
-        mtime = self.bobobase_modification_time().timeTime()
+        mtime = self._entry.mtime
         owner = group = 'Zope'
         return marshal.dumps((mode, 0, 0, 1, owner, group, size, mtime, mtime, mtime))
 
 
+class LocalFileStat(Acquisition.Implicit):
+
+    """Response to a HEAD or conditional GET request of a local file, 
+    made from the stat data of the file without building its object."""
+
+    security = AccessControl.ClassSecurityInfo()
+
+    def __init__(self, id, entry, content_type, etag):
+        """LocalFileStat __init__"""
+        self.id = id
+        self._entry = entry
+        self.content_type = content_type
+        self.etag = etag
+
+    def _setHeaders(self, RESPONSE):
+        """_setHeaders"""
+        RESPONSE.setHeader('Last-Modified', rfc1123_date(self._entry.mtime))
+        RESPONSE.setHeader('ETag', self.etag)
+        RESPONSE.setHeader('Content-Type', self.content_type)
+        RESPONSE.setHeader('Accept-Ranges', 'bytes')
+
+    security.declareProtected('View', 'index_html')
+    def index_html(self, REQUEST, RESPONSE):
+        """Answer a conditional GET request of an unchanged file."""
+        self._setHeaders(RESPONSE)
+        RESPONSE.setStatus(304)
+        return b''
+
+    security.declareProtected('View', 'HEAD')
+    def HEAD(self, REQUEST, RESPONSE):
+        """Answer a HEAD request."""
+        self._setHeaders(RESPONSE)
+        if not_modified(REQUEST, self.etag, self._entry.mtime):
+            RESPONSE.setStatus(304)
+        else:
+            RESPONSE.setHeader('Content-Length', self._entry.size)
+        return b''
+
+InitializeClass(LocalFileStat)
+
+
+@implementer(IUnboundStreamIterator)
+class json_listing_iterator:
+    """ Stream iterator over the JSON encoded entries of a listing """
+    # The listing is encoded in chunks of 'batch' entries while it is 
+    # sent. The iterator only uses the values it is created with, since
+    # it is consumed after the request has been processed.
+
+    batch = 200
+
+    def __init__(self, entries, basepath, _type_map):
+        self.entries = entries
+        self.basepath = basepath
+        self._type_map = _type_map
+        self._chunks = self._generate()
+
+    def _generate(self):
+        dumps = json.dumps
+        entries = self.entries
+        batch = self.batch
+        join = os.path.join
+        sep = '['
+        for i in range(0, len(entries), batch):
+            r = []
+            for e in entries[i:i + batch]:
+                r.append(sep)
+                r.append(dumps({
+                    'name': e.name,
+                    'type': _entry_content_type(
+                        e, join(self.basepath, e.name), self._type_map),
+                    'size': e.size,
+                    'mtime': e.mtime,
+                    'is_dir': bool(e.isdir),
+                    }))
+                sep = ','
+            yield ''.join(r).encode('utf-8')
+        yield sep == '[' and b'[]' or b']'
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._chunks)
+
+    next = __next__
+
+
+class LocalNullResource(Acquisition.Implicit):
+
+    """Placeholder for a file that does not exist in a local directory 
+    yet. A PUT request creates the file from the request body."""
+
+    security = AccessControl.ClassSecurityInfo()
+
+    def __init__(self, id):
+        """LocalNullResource __init__"""
+        self.id = id
+
+    security.declareProtected('Upload local files', 'PUT')
+    def PUT(self, REQUEST, RESPONSE):
+        """Create the file from the body of a PUT request."""
+        if self.aq_parent._putFile(self.id, REQUEST):
+            RESPONSE.setStatus(201)
+        return RESPONSE
+
+    security.declareProtected('Upload local files', 'manage_FTPput')
+    manage_FTPput = PUT
+
+InitializeClass(LocalNullResource)
+
+
+class LocalFileResource(LocalNullResource):
+
+    """Placeholder for an existing file of a local directory that a PUT
+    request replaces with the request body, without building its object."""
+
+    security = AccessControl.ClassSecurityInfo()
+
+    security.declareProtected('Overwrite local files', 'PUT')
+    def PUT(self, REQUEST, RESPONSE):
+        """Replace the file with the body of a PUT request."""
+        if self.aq_parent._putFile(self.id, REQUEST):
+            RESPONSE.setStatus(204)
+        return RESPONSE
+
+    security.declareProtected('Overwrite local files', 'manage_FTPput')
+    manage_FTPput = PUT
+
+InitializeClass(LocalFileResource)
+
+
 class FileMoniker:
 
     """A file moniker is a reference to an object in the file system."""
@@ -1488,6 +3335,15 @@ class FileMoniker:
             ob = ob._safe_getOb(id)
         return ob
 
+    def path(self, root):
+        """Return the path of the file named by this moniker, or None if
+        the ids are not valid file names."""
+        for id in self.ids:
+            if not id or not valid_id(id) or os.sep in id or \
+                    (os.altsep and os.altsep in id):
+                return None
+        return os.path.join(root.basepath, *self.ids)
+
 
 class LocalFS(
     LocalDirectory,
@@ -1519,13 +3375,17 @@ class LocalFS(
         ('View', ('',)),
         ('View Directory Index', ('index_html',)),
         ('View management screens', 
-            ('manage', 'manage_main')),
+            ('manage', 'manage_main', 'manage_batchStart', 'cacheInfo')),
         ('Change Local File System properties', 
-            ('manage_propertiesForm', 'manage_changeProperties')),
+            ('manage_propertiesForm', 'manage_changeProperties',
+            'manage_refreshIndex')),
         ('Access contents information', 
-            ('fileIds', 'fileValues', 'fileItems')),
+            ('fileIds', 'fileValues', 'fileItems', 'fileCount', 
+            'listing_json', 'walk', 'find', 'queryFiles')),
         ('Upload local files',
-            ('manage_uploadForm', 'manage_upload')), # ***SmileyChris no WAY should anonymous be allowed to upload by default!
+            ('manage_uploadForm', 'manage_upload', 'manage_uploadStart',
+            'manage_uploadChunk', 'manage_uploadStatus', 
+            'manage_uploadFinish', 'manage_uploadAbort')), # ***SmileyChris no WAY should anonymous be allowed to upload by default!
         ('Overwrite local files', ('manage_overwrite',)),
         ('Manage local files', 
             ('manage_cutObjects', 'manage_copyObjects', 'manage_pasteObjects',
@@ -1549,6 +3409,13 @@ class LocalFS(
         {'id': 'catalog', 'type': 'boolean', 'mode': 'w'},
         {'id': 'tree_view', 'type': 'boolean', 'mode': 'w'},
         {'id': 'file_filter', 'type': 'string', 'mode': 'w'},	
+        {'id': 'object_cache_size', 'type': 'int', 'mode': 'w'},
+        {'id': 'listing_cache_size', 'type': 'int', 'mode': 'w'},
+        {'id': 'listing_cache_ttl', 'type': 'int', 'mode': 'w'},
+        {'id': 'index_enabled', 'type': 'boolean', 'mode': 'w'},
+        {'id': 'index_path', 'type': 'string', 'mode': 'w'},
+        {'id': 'fsync_writes', 'type': 'boolean', 'mode': 'w'},
+        {'id': 'upload_max_age', 'type': 'int', 'mode': 'w'},
     )
 
     default_document = 'index.html default.html'
@@ -1565,6 +3432,16 @@ class LocalFS(
     type_map = _typemap2list(_types)
     icon_map = _iconmap2list(_icons)
     file_filter = None
+    object_cache_size = 500
+    listing_cache_size = 100
+    listing_cache_ttl = 10
+    negative_cache_size = 100
+    tree_cache_size = 1000
+    walk_workers = 8
+    index_enabled = 0
+    index_path = ''
+    fsync_writes = 0
+    upload_max_age = 86400
     
     def __init__(self, id, title, basepath, username, password):
         """LocalFS __init__"""
@@ -1602,8 +3479,10 @@ class LocalFS(
             self.file_filter = None
         if self.file_filter == 'None':
             self.file_filter = None
+        _get_filter(self.file_filter)
         if self.type_map != type_map:
             self._type_map = _list2typemap(self.type_map)
+            _get_dispatch(self._type_map)
         if self.icon_map != type_map:
             self._icon_map = _list2iconmap(self.icon_map)
         if (_iswin32):
@@ -1635,8 +3514,10 @@ class LocalFS(
             username = self.username
             password = self._password
         OFS.PropertyManager.PropertyManager.manage_changeProperties(self, REQUEST, **kw)
+        _get_filter(self.file_filter)
         if self.type_map != type_map:
             self._type_map = _list2typemap(self.type_map)
+            _get_dispatch(self._type_map)
         if self.icon_map != type_map:
             self._icon_map = _list2iconmap(self.icon_map)
         if (_iswin32):
@@ -1667,25 +3548,65 @@ class LocalFS(
         if (self._share and not self._connected):
             self._connect()
 
-    def _ids(self, spec=None):
-        """_ids"""
+    def _entries(self, spec=None):
+        """_entries"""
         self._check_connected()
-        return LocalDirectory._ids(self, spec)
+        return LocalDirectory._entries(self, spec)
 
-    def _getfileob(self, id, spec=None):
+    def _getfileob(self, id, spec=None, entry=None):
         """_getfileob"""
         self._check_connected()
-        return LocalDirectory._getfileob(self, id, spec)
+        return LocalDirectory._getfileob(self, id, spec, entry)
 
     def _getOb(self, id, default=_marker):
         """_getOb"""
         self._check_connected()
         return LocalDirectory._getOb(self, id, default)
 
+    def _getStatOb(self, id, REQUEST, method):
+        """_getStatOb"""
+        self._check_connected()
+        return LocalDirectory._getStatOb(self, id, REQUEST, method)
+
+    def _getPutOb(self, id):
+        """_getPutOb"""
+        self._check_connected()
+        return LocalDirectory._getPutOb(self, id)
+
+    def _subdirs(self, first=0):
+        """_subdirs"""
+        self._check_connected()
+        return LocalDirectory._subdirs(self, first)
+
+    def _walk(self, spec=None, prune=None):
+        """_walk"""
+        self._check_connected()
+        return LocalDirectory._walk(self, spec, prune)
+
+    def _getIndex(self):
+        """_getIndex"""
+        self._check_connected()
+        return LocalDirectory._getIndex(self)
+
+    def _getStaging(self):
+        """_getStaging"""
+        self._check_connected()
+        return LocalDirectory._getStaging(self)
+
     def bobobase_modification_time(self):
         """bobobase_modification_time"""
         return Persistence.Persistent.bobobase_modification_time(self)
 
+    def cacheInfo(self):
+        """Return a mapping of cache names to cache statistics 
+        (size, maxsize, hits, misses and evictions)."""
+        return {
+            'object': self._getCache('object').info(),
+            'listing': self._getCache('listing').info(),
+            'negative': self._getCache('negative').info(),
+            'tree': self._getCache('tree').info(),
+        }
+
     def hasDefaultDocument(self):
         """Return true if is Directory and has default doc"""
         # self.default_document is sometimes empty
@@ -1693,7 +3614,7 @@ class LocalFS(
             files = self.default_document.split()
             for file in files:
                 path = self._getpath(file)
-                if (os.path.isfile(path)):
+                if _isfile(path):
                     try:
                         return self._safe_getOb(file)
                     except Forbidden:
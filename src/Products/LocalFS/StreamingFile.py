@@ -1,21 +1,35 @@
 """Local File System product"""
 __doc__="""Local File System product"""
 
-from OFS.Image import File, Image, Pdata
-from io import StringIO
+import os, uuid
+from threading import Lock
+from DateTime import DateTime
+from zope.interface import implementer
+from OFS.Image import File, Image, Pdata, getImageInfo
+from io import BytesIO
+from App.Common import rfc1123_date
 from ZPublisher.HTTPRequest import FileUpload
+from ZPublisher.HTTPRangeSupport import parseRange, expandRanges
+from ZPublisher.Iterators import IStreamIterator
+try:
+    from ZPublisher.Iterators import filestream_iterator
+except ImportError:
+    filestream_iterator = None
 
 BUFFER_SIZE = 1 << 16
 
+_pread = getattr(os, 'pread', None)
+_seek_lock = Lock()
+
 def _read_data(self, file):
     # We do not want to load the whole file into memory, so just
     # get the file size and return a faked Pdata object.
-    if isinstance(file, str):
+    if isinstance(file, bytes):
         size = len(file)
         if size < BUFFER_SIZE: 
             return file, size
         # Big string: cut it into smaller chunks
-        file = StringIO(file)
+        file = BytesIO(file)
 
     if isinstance(file, FileUpload) and not file:
         raise ValueError('File not specified')
@@ -24,20 +38,254 @@ def _read_data(self, file):
         size = len(file)
         return file, size
 
+    if isinstance(file, LocalPath):
+        size = os.stat(file.name).st_size
+        return Sdata(file, size), size
+
     pos = file.tell()
     size = file.seek(0, 2)
     file.seek(pos, 0)
     return Sdata(file, size), size
 
 
+def stat_etag(ino, size, mtime):
+    """Return the entity tag of a local file from its stat data."""
+    return '"%x-%x-%x"' % (ino or 0, size, int(mtime * 1000000))
+
+def not_modified(REQUEST, etag, mtime):
+    """Return true if the conditional headers of the request match the
+    entity tag or the modification time of a file."""
+    if_none_match = REQUEST.get_header('If-None-Match', None)
+    if if_none_match is not None:
+        tags = [t.strip() for t in if_none_match.split(',')]
+        return '*' in tags or etag in tags or ('W/' + etag) in tags
+    if_modified_since = REQUEST.get_header('If-Modified-Since', None)
+    if if_modified_since is not None:
+        try:
+            mod_since = DateTime(if_modified_since.split(';')[0]).timeTime()
+        except Exception:
+            return 0
+        return int(mtime) <= int(mod_since)
+    return 0
+
+def _local_file(self):
+    # Return the path of the local file if the data of the object is
+    # still streamed from it, so it can be published as a file.
+    path = getattr(self, '_local_path', None)
+    if path is None or filestream_iterator is None:
+        return None
+    data = self.data
+    if isinstance(data, Sdata) and getattr(data.file, 'name', None) == path:
+        return path
+    return None
+
+def _get_ranges(self, REQUEST, size, etag, mtime):
+    # Return the list of (start, end) byte ranges requested, an empty 
+    # list if none of them can be satisfied, or None if the whole file 
+    # has to be sent.
+    range = REQUEST.get_header('Range', None)
+    request_range = REQUEST.get_header('Request-Range', None)
+    if request_range is not None:
+        # Netscape 2 through 4 and MSIE 3 implement a draft version
+        range = request_range
+    if range is None:
+        return None
+    ranges = parseRange(range)
+    if not ranges:
+        # Syntactically invalid, ignore it
+        return None
+    if_range = REQUEST.get_header('If-Range', None)
+    if if_range is not None:
+        # Only send ranges if the data isn't modified, otherwise send
+        # the whole object. Support both ETags and Last-Modified dates.
+        if if_range[:1] == '"' or if_range[:2] in ('W/', 'ts'):
+            if if_range[:2] == 'W/' or if_range != etag:
+                return None
+        else:
+            try:
+                mod_since = int(DateTime(if_range.split(';')[0]).timeTime())
+            except Exception:
+                return None
+            if int(mtime) > mod_since:
+                return None
+    return expandRanges(ranges, size)
+
+def _stream_ranges(self, REQUEST, RESPONSE, read, size, etag, mtime, 
+                   close=None):
+    # Serve a range request with positional reads of the requested
+    # spans only. Return None if the whole file has to be sent. 'close'
+    # is called by the returned byterange_iterator when it is done.
+    ranges = _get_ranges(self, REQUEST, size, etag, mtime)
+    if ranges is None:
+        return None
+    RESPONSE.setHeader('Last-Modified', rfc1123_date(mtime))
+    RESPONSE.setHeader('Accept-Ranges', 'bytes')
+    if not ranges:
+        RESPONSE.setHeader('Content-Range', 'bytes */%d' % size)
+        RESPONSE.setHeader('Content-Type', self.content_type)
+        RESPONSE.setHeader('Content-Length', 0)
+        RESPONSE.setStatus(416)
+        return b''
+    RESPONSE.setStatus(206)
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        RESPONSE.setHeader('Content-Type', self.content_type)
+        RESPONSE.setHeader('Content-Length', end - start)
+        RESPONSE.setHeader('Content-Range', 
+            'bytes %d-%d/%d' % (start, end - 1, size))
+        return byterange_iterator(read, [(b'', start, end)], b'', close)
+    boundary = uuid.uuid4().hex
+    parts = []
+    for start, end in ranges:
+        header = ('\r\n--%s\r\nContent-Type: %s\r\n'
+                  'Content-Range: bytes %d-%d/%d\r\n\r\n' % (
+                  boundary, self.content_type, start, end - 1, size))
+        parts.append((header.encode('latin-1'), start, end))
+    stream = byterange_iterator(read, parts, 
+        ('\r\n--%s--\r\n' % boundary).encode('latin-1'), close)
+    RESPONSE.setHeader('Content-Type', 
+        'multipart/byteranges; boundary=%s' % boundary)
+    RESPONSE.setHeader('Content-Length', len(stream))
+    return stream
+
+def _fd_reader(fd):
+    # Return a function read(pos, size) for the file descriptor 'fd'
+    if _pread is not None:
+        return lambda pos, size: _pread(fd, size, pos)
+    def read(pos, size):
+        os.lseek(fd, pos, os.SEEK_SET)
+        return os.read(fd, size)
+    return read
+
+def _reader(data):
+    # Return a function read(pos, size) for the data of a file
+    if isinstance(data, Sdata):
+        return data._read
+    return lambda pos, size: data[pos:pos+size]
+
+def _precondition(self, REQUEST):
+    if self.precondition and hasattr(self, str(self.precondition)):
+        c = getattr(self, str(self.precondition))
+        if hasattr(c, 'isDocTemp') and c.isDocTemp:
+            c(REQUEST['PARENTS'][1], REQUEST)
+        else:
+            c()
+
+def _index_local(self, REQUEST, RESPONSE, path):
+    # Publish the local file 'path'. The file is opened once and all
+    # headers are made from the stat of the open file, so they describe
+    # the bytes that are sent even if the file is replaced meanwhile.
+    fd = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    try:
+        st = os.fstat(fd)
+        size, mtime = st.st_size, st.st_mtime
+        etag = stat_etag(st.st_ino, size, mtime)
+        RESPONSE.setHeader('ETag', etag)
+        if not_modified(REQUEST, etag, mtime):
+            RESPONSE.setHeader('Last-Modified', rfc1123_date(mtime))
+            RESPONSE.setHeader('Content-Type', self.content_type)
+            RESPONSE.setHeader('Accept-Ranges', 'bytes')
+            RESPONSE.setStatus(304)
+            self.ZCacheable_set(None)
+            return b''
+        _precondition(self, REQUEST)
+        # Ranges are sent by a byterange_iterator, which closes the file
+        # when it is done. A file object would be sent as a whole by 
+        # WSGIResponse.setBody.
+        stream = _stream_ranges(self, REQUEST, RESPONSE, _fd_reader(fd), 
+            size, etag, mtime, lambda fd=fd: os.close(fd))
+        if isinstance(stream, byterange_iterator):
+            fd = None
+        if stream is not None:
+            return stream
+        RESPONSE.setHeader('Last-Modified', rfc1123_date(mtime))
+        RESPONSE.setHeader('Content-Type', self.content_type)
+        RESPONSE.setHeader('Content-Length', size)
+        RESPONSE.setHeader('Accept-Ranges', 'bytes')
+        self.ZCacheable_set(None)
+        # The iterator owns the file descriptor from here on
+        stream = filestream_iterator(fd, 'rb', -1, BUFFER_SIZE)
+        fd = None
+        return stream
+    finally:
+        if fd is not None:
+            os.close(fd)
+
+def index_html(self, REQUEST, RESPONSE):
+    """
+    The default view of the contents of a File or Image.
+
+    Local files are returned as a file stream iterator, so the server can
+    send them with wsgi.file_wrapper (and sendfile, where it is
+    available) without copying the data through Python. Range requests
+    only read the requested spans.
+    """
+    path = _local_file(self)
+    if path is not None:
+        return _index_local(self, REQUEST, RESPONSE, path)
+    data = self.data
+    if not isinstance(data, (bytes, Sdata)):
+        return File.index_html(self, REQUEST, RESPONSE)
+
+    if self._if_modified_since_request_handler(REQUEST, RESPONSE):
+        self.ZCacheable_set(None)
+        return b''
+
+    _precondition(self, REQUEST)
+    stream = _stream_ranges(self, REQUEST, RESPONSE, _reader(data), 
+        self.size, self.http__etag(readonly=1), self._p_mtime)
+    if stream is not None:
+        return stream
+
+    RESPONSE.setHeader('Last-Modified', rfc1123_date(self._p_mtime))
+    RESPONSE.setHeader('Content-Type', self.content_type)
+    RESPONSE.setHeader('Content-Length', self.size)
+    RESPONSE.setHeader('Accept-Ranges', 'bytes')
+    self.ZCacheable_set(None)
+    if isinstance(data, bytes):
+        RESPONSE.setBase(None)
+        return data
+    while data is not None:
+        RESPONSE.write(data.data)
+        data = data.next
+    return b''
+
+
 class StreamingFile(File):
     """ Wrapper around OFS.Image.File """
     _read_data = _read_data
+    index_html = index_html
 
 
 class StreamingImage(Image):
     """ Wrapper around OFS.Image.Image """
     _read_data = _read_data
+    index_html = index_html
+
+    def update_data(self, data, content_type=None, size=None):
+        if not isinstance(data, Sdata):
+            return Image.update_data(self, data, content_type, size)
+        # Only look at the first chunk to get the image info
+        # instead of reading the whole image into memory.
+        File.update_data(self, data, content_type, size)
+        ct, width, height = getImageInfo(data.data)
+        if ct:
+            self.content_type = ct
+        if width >= 0 and height >= 0:
+            self.width = width
+            self.height = height
+
+
+class LocalPath:
+    """ The path of a local file, which is opened only while it is read """
+    # Objects built from local files keep no file descriptor open, so any
+    # number of them can be held by listings and caches.
+
+    def __init__(self, name):
+        self.name = name
+
+    def open(self):
+        return os.open(self.name, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
 
 
 class Sdata(Pdata):
@@ -54,13 +302,35 @@ class Sdata(Pdata):
 
     @property
     def data(self):
-        return self[0:BUFFER_SIZE]
+        return self._read(self.offset, min(BUFFER_SIZE, len(self)))
 
     @property
     def next(self):
         offset = self.offset + BUFFER_SIZE
         if offset < self.fsize:
-            return Sdata(self.file, self.fsize, offset)
+            return self._chunk(offset)
+
+    def _chunk(self, offset):
+        return Sdata(self.file, self.fsize, offset)
+
+    def _read(self, pos, size):
+        # Read with os.pread if possible, so that threads sharing the 
+        # file do not race on the file position.
+        if isinstance(self.file, LocalPath):
+            fd = self.file.open()
+            try:
+                return _fd_reader(fd)(pos, size)
+            finally:
+                os.close(fd)
+        try:
+            fd = self.file.fileno()
+        except (AttributeError, OSError, ValueError):
+            fd = None
+        if fd is not None and _pread is not None:
+            return _pread(fd, size, pos)
+        with _seek_lock:
+            self.file.seek(pos, 0)
+            return self.file.read(size)
 
     def __getslice__(self, i, j):
         size = min(BUFFER_SIZE, len(self))
@@ -70,14 +340,77 @@ class Sdata(Pdata):
         if j < 0:
             j = max(j + size, 0)
         if i >= j:
-            return ''
-        self.file.seek(self.offset+i, 0)
-        return self.file.read(j-i)
+            return b''
+        return self._read(self.offset+i, j-i)
+
+    def __getitem__(self, key):
+        # Like Pdata, index into the data of this chunk only
+        if isinstance(key, slice):
+            size = min(BUFFER_SIZE, len(self))
+            i, j, step = key.indices(size)
+            data = self.__getslice__(i, j)
+            if step != 1:
+                data = data[::step]
+            return data
+        return self.data[key]
 
     def __len__(self):
         return self.fsize - self.offset
 
-    def __str__(self):
-        self.file.seek(self.offset, 0)
-        return self.file.read()
+    def __bytes__(self):
+        return self._read(self.offset, len(self))
+
+
+@implementer(IStreamIterator)
+class byterange_iterator:
+    """ Stream iterator over byte ranges of a file """
+    # 'parts' is a list of (header, start, end) tuples. Each range is
+    # read in chunks of BUFFER_SIZE with the positional reader 'read'.
 
+    def __init__(self, read, parts, trailer=b'', close=None):
+        # Not named 'read': the publisher hands objects with a read method
+        # to wsgi.file_wrapper, which calls read(size)
+        self._read = read
+        self.parts = parts
+        self.trailer = trailer
+        self._close = close
+        self.length = len(trailer)
+        for header, start, end in parts:
+            self.length += len(header) + end - start
+        self._chunks = self._generate()
+
+    def _generate(self):
+        read = self._read
+        try:
+            for header, start, end in self.parts:
+                if header:
+                    yield header
+                while start < end:
+                    data = read(start, min(BUFFER_SIZE, end - start))
+                    if not data:
+                        return
+                    start += len(data)
+                    yield data
+            if self.trailer:
+                yield self.trailer
+        finally:
+            self.close()
+
+    def close(self):
+        close, self._close = self._close, None
+        if close is not None:
+            close()
+
+    def __del__(self):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._chunks)
+
+    next = __next__
+
+    def __len__(self):
+        return self.length
@@ -0,0 +1,267 @@
+"""Local File System chunked uploads"""
+__doc__="""Local File System chunked uploads"""
+
+import os, re, json, time, uuid, hashlib
+from threading import Lock
+
+############################################################################
+# A chunked upload is a session in the staging directory of a LocalFS.
+# The session '<token>' consists of the data received so far in
+# '<token>.part' and of its settings in '<token>.json'. Chunks are
+# written at an offset up to the current size of the data, so an
+# interrupted upload can be resumed from the size of the part file.
+#
+# If the session has a checksum, the hash of the data is updated as
+# chunks are written. The hash state is kept in memory while the data
+# is appended; otherwise it is computed again from the part file.
+#
+# The staging directory is in the base path of the LocalFS, so finished
+# uploads can be renamed into place. Its name starts with '_', which
+# hides it from listings.
+############################################################################
+
+BUFFER_SIZE = 1 << 20
+
+_token_match = re.compile('[0-9a-f]{32,64}$').match
+
+
+class StagingError(ValueError):
+    """ Invalid chunked upload request """
+
+
+class Staging:
+    """ Staging directory of chunked uploads """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = Lock()
+        self._locks = {}
+        self._hashes = {}
+
+    def _paths(self, token):
+        if not isinstance(token, str) or not _token_match(token):
+            raise StagingError('Invalid upload token')
+        base = os.path.join(self.path, token)
+        return base + '.part', base + '.json'
+
+    def _session_lock(self, token):
+        with self._lock:
+            lock = self._locks.get(token)
+            if lock is None:
+                lock = self._locks[token] = Lock()
+            return lock
+
+    def tokenFor(self, target):
+        """Return the token of the upload session for the file 'target'
+        that is used by Content-Range PUT requests."""
+        return hashlib.sha1(target.encode('utf-8')).hexdigest()
+
+    def start(self, target, size=None, checksum=None, token=None):
+        """Start a session for the file 'target' and return its token.
+        'checksum' is an 'algorithm:hexdigest' string."""
+        if checksum:
+            algorithm, _, digest = checksum.partition(':')
+            algorithm = algorithm.lower()
+            # Variable length digests (shake_*) have a digest_size of 0
+            n = 0
+            if algorithm in hashlib.algorithms_guaranteed:
+                n = hashlib.new(algorithm).digest_size
+            if not n or len(digest) != 2 * n:
+                raise StagingError('Invalid checksum %s' % repr(checksum))
+        if size is not None:
+            size = int(size)
+            if size < 0:
+                raise StagingError('Invalid size %s' % size)
+        if token is None:
+            token = uuid.uuid4().hex
+        part, meta = self._paths(token)
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        with self._session_lock(token):
+            fd = os.open(part, os.O_WRONLY | os.O_CREAT | os.O_TRUNC |
+                getattr(os, 'O_BINARY', 0), 0o666)
+            os.close(fd)
+            with open(meta, 'w') as f:
+                json.dump({'target': target, 'size': size,
+                           'checksum': checksum or None,
+                           'started': time.time()}, f)
+            self._hashes.pop(token, None)
+        return token
+
+    def exists(self, token):
+        """Return true if the session 'token' exists."""
+        return os.path.exists(self._paths(token)[1])
+
+    def settings(self, token):
+        """Return the settings of the session 'token'."""
+        try:
+            with open(self._paths(token)[1]) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            raise StagingError('Unknown upload %s' % token)
+
+    def offset(self, token):
+        """Return the size of the data received by the session 'token'."""
+        try:
+            return os.stat(self._paths(token)[0]).st_size
+        except OSError:
+            raise StagingError('Unknown upload %s' % token)
+
+    def _new_hash(self, token):
+        checksum = self.settings(token)['checksum']
+        if not checksum:
+            return None
+        return hashlib.new(checksum.split(':', 1)[0].lower())
+
+    def _hash_file(self, token, fd, end):
+        # Compute the hash of the first 'end' bytes of the part file
+        h = self._new_hash(token)
+        if h is not None:
+            pos = 0
+            while pos < end:
+                data = os.pread(fd, min(BUFFER_SIZE, end - pos), pos)
+                if not data:
+                    break
+                h.update(data)
+                pos += len(data)
+        return h
+
+    def append(self, token, offset, data, length=None):
+        """Write 'data' (bytes or a file object) at 'offset' of the data of
+        the session 'token', dropping any data after it, and return the new
+        size. 'length' limits the number of bytes read from a file."""
+        offset = int(offset)
+        part = self._paths(token)[0]
+        settings = self.settings(token)
+        with self._session_lock(token):
+            fd = os.open(part, os.O_RDWR | getattr(os, 'O_BINARY', 0))
+            try:
+                current = os.fstat(fd).st_size
+                if offset < 0 or offset > current:
+                    raise StagingError(
+                        'Invalid offset %d, %d bytes received' %
+                        (offset, current))
+                if offset < current:
+                    os.ftruncate(fd, offset)
+                state = self._hashes.pop(token, None)
+                if state is not None and state[0] == offset:
+                    h = state[1]
+                else:
+                    h = self._hash_file(token, fd, offset)
+                os.lseek(fd, offset, os.SEEK_SET)
+                size = settings['size']
+                for chunk in _chunks(data, length):
+                    if size is not None and offset + len(chunk) > size:
+                        raise StagingError('The upload exceeds its size')
+                    view = memoryview(chunk)
+                    while view:
+                        view = view[os.write(fd, view):]
+                    if h is not None:
+                        h.update(chunk)
+                    offset += len(chunk)
+                if h is not None:
+                    self._hashes[token] = (offset, h)
+            finally:
+                os.close(fd)
+        return offset
+
+    def finish(self, token, fsync=0):
+        """Verify the data of the session 'token' against its size and
+        checksum and return the path of the part file and the settings.
+        The caller renames the part file and then calls remove."""
+        part = self._paths(token)[0]
+        settings = self.settings(token)
+        with self._session_lock(token):
+            fd = os.open(part, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+            try:
+                end = os.fstat(fd).st_size
+                if settings['size'] is not None and end != settings['size']:
+                    raise StagingError(
+                        'Incomplete upload, %d of %d bytes received' %
+                        (end, settings['size']))
+                checksum = settings['checksum']
+                if checksum:
+                    state = self._hashes.get(token)
+                    if state is not None and state[0] == end:
+                        h = state[1]
+                    else:
+                        h = self._hash_file(token, fd, end)
+                    if h.hexdigest() != checksum.split(':', 1)[1].lower():
+                        raise StagingError('Checksum mismatch')
+                if fsync:
+                    os.fsync(fd)
+            finally:
+                os.close(fd)
+        return part, settings
+
+    def remove(self, token):
+        """Remove the session 'token'."""
+        for path in self._paths(token):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        with self._lock:
+            self._hashes.pop(token, None)
+            self._locks.pop(token, None)
+
+    def collect(self, max_age):
+        """Remove the sessions that received no data for 'max_age' seconds.
+        """
+        if max_age <= 0:
+            return
+        limit = time.time() - max_age
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return
+        for name in names:
+            token, ext = os.path.splitext(name)
+            if ext != '.json' or not _token_match(token):
+                continue
+            try:
+                mtime = max([os.stat(p).st_mtime
+                             for p in self._paths(token)
+                             if os.path.exists(p)] or [0])
+            except OSError:
+                continue
+            if mtime < limit:
+                self.remove(token)
+
+
+def _chunks(data, length=None):
+    # Generate the data of 'data' (bytes or a file object) in chunks of
+    # BUFFER_SIZE, at most 'length' bytes of a file object.
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        for i in range(0, len(data), BUFFER_SIZE):
+            yield bytes(data[i:i + BUFFER_SIZE])
+        return
+    remaining = length
+    while remaining is None or remaining > 0:
+        n = BUFFER_SIZE
+        if remaining is not None:
+            n = min(n, remaining)
+        chunk = data.read(n)
+        if not chunk:
+            break
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        if remaining is not None:
+            remaining -= len(chunk)
+        yield chunk
+
+
+_stagings = {}
+_stagings_lock = Lock()
+
+def getStaging(path):
+    """Return the staging directory 'path'."""
+    staging = _stagings.get(path)
+    if staging is None:
+        with _stagings_lock:
+            staging = _stagings.get(path)
+            if staging is None:
+                staging = _stagings[path] = Staging(path)
+    return staging
@@ -0,0 +1,127 @@
+"""Benchmarks of LocalFS
+
+These are not run by the test suite. Run them with
+
+    python -m Products.LocalFS.tests.benchmarks [name ...]
+
+where 'name' is one of the benchmarks below (all of them by default).
+"""
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from Products.LocalFS.LocalFS import LocalFS
+from Products.LocalFS.tests.test_publish import makeRequest, publish
+
+
+def _report(name, value, unit):
+    print('  %-40s %12.2f %s' % (name, value, unit))
+
+def _mkfs():
+    dir = tempfile.mkdtemp()
+    return dir, LocalFS('fs', '', dir, '', '')
+
+
+def bench_ranges(requests=2000, length=256 << 10, size=4 << 30):
+    """Throughput of single byte range requests at random offsets of a 
+    sparse file of several GB."""
+    dir, fs = _mkfs()
+    try:
+        with open(os.path.join(dir, 'large.iso'), 'wb') as f:
+            f.truncate(size)
+        ob = fs._getOb('large.iso')
+        rand = random.Random(0)
+        print('%d byte ranges of a %d GB file' % (length, size >> 30))
+        sent = 0
+        t = time.perf_counter()
+        for i in range(requests):
+            start = rand.randrange(size - length)
+            response, body = publish(ob, 
+                range='bytes=%d-%d' % (start, start + length - 1))
+            assert response.getStatus() == 206
+            sent += len(body)
+        t = time.perf_counter() - t
+        _report('requests', requests / t, 'requests/s')
+        _report('throughput', sent / t / (1 << 20), 'MB/s')
+    finally:
+        shutil.rmtree(dir)
+
+
+def bench_listing(entries=50000):
+    """Per entry cost of listing a large directory, with the names only
+    and with the display attributes of methodBrowse."""
+    dir, fs = _mkfs()
+    try:
+        for i in range(entries):
+            with open(os.path.join(dir, 'file%06d.txt' % i), 'wb') as f:
+                f.write(b'x' * (i % 4096))
+        fs.fileValues() # fill the listing cache
+        print('listing %d entries' % entries)
+        t = time.perf_counter()
+        files = fs.fileValues()
+        ids = [f.id for f in files]
+        names = time.perf_counter() - t
+        _report('names only', names * 1e6 / entries, 'us/entry')
+        t = time.perf_counter()
+        for f in files:
+            f.url, f.icon, f.type, f.display_size, f.display_mtime
+        _report('display attributes',
+            (time.perf_counter() - t) * 1e6 / entries, 'us/entry')
+        del files, ids
+        tracemalloc.start()
+        files = fs.fileValues()
+        ids = [f.id for f in files]
+        _report('memory, names only',
+            tracemalloc.get_traced_memory()[0] / entries, 'bytes/entry')
+        for f in files:
+            f.url, f.icon, f.type, f.display_size, f.display_mtime
+        _report('memory, display attributes',
+            tracemalloc.get_traced_memory()[0] / entries, 'bytes/entry')
+        tracemalloc.stop()
+    finally:
+        shutil.rmtree(dir)
+
+
+def bench_conditional_get(requests=5000, size=64 << 10):
+    """Requests per second of GET requests answered with the file (200)
+    and of conditional GET requests of an unchanged file (304)."""
+    dir, fs = _mkfs()
+    try:
+        with open(os.path.join(dir, 'image.gif'), 'wb') as f:
+            f.write(b'GIF89a' + b'x' * size)
+        etag = publish(fs._getOb('image.gif'))[0].getHeader('ETag')
+        print('GET of a %d byte file' % size)
+        for name, headers in (('200', {}), ('304', {'if_none_match': etag})):
+            t = time.perf_counter()
+            for i in range(requests):
+                request, response = makeRequest(**headers)
+                ob = fs.__bobo_traverse__(request, 'image.gif')
+                response.setBody(ob.index_html(request, response))
+                body = response.body
+                if hasattr(body, 'read'):
+                    body.read()
+                    body.close()
+                assert response.getStatus() == int(name)
+            _report(name, requests / (time.perf_counter() - t), 
+                'requests/s')
+    finally:
+        shutil.rmtree(dir)
+
+
+benchmarks = {
+    'conditional_get': bench_conditional_get,
+    'listing': bench_listing,
+    'ranges': bench_ranges,
+}
+
+def main(args):
+    for name in args or sorted(benchmarks):
+        benchmarks[name]()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
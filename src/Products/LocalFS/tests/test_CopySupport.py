@@ -0,0 +1,119 @@
+"""Tests of copying and moving local files"""
+
+import errno
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from OFS.CopySupport import CopyError
+
+from Products.LocalFS.LocalFS import LocalFS
+
+
+class CopySupportTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fs = LocalFS('fs', '', self.dir, '', '')
+        os.mkdir(os.path.join(self.dir, 'src'))
+        os.mkdir(os.path.join(self.dir, 'dst'))
+        self.src = self.fs._getOb('src')
+        self.dst = self.fs._getOb('dst')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _write(self, name, data=b''):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def _read(self, name):
+        with open(os.path.join(self.dir, name), 'rb') as f:
+            return f.read()
+
+    def _listdir(self, name):
+        return sorted(os.listdir(os.path.join(self.dir, name)))
+
+    def test_copy_file(self):
+        path = self._write('src/a.txt', b'data')
+        os.chmod(path, 0o640)
+        self.dst.manage_pasteObjects(self.src.manage_copyObjects('a.txt'))
+        self.assertEqual(self._read('dst/a.txt'), b'data')
+        self.assertEqual(self._read('src/a.txt'), b'data')
+        self.assertEqual(os.stat(os.path.join(self.dir, 'dst', 'a.txt'))
+            .st_mode & 0o777, 0o640)
+        self.assertEqual(self._listdir('dst'), ['a.txt'])
+
+    def test_copy_tree(self):
+        os.makedirs(os.path.join(self.dir, 'src', 'tree', 'sub'))
+        self._write('src/tree/a.txt', b'a')
+        self._write('src/tree/sub/b.txt', b'b' * 100000)
+        os.symlink('a.txt', os.path.join(self.dir, 'src', 'tree', 'link'))
+        self.dst.manage_pasteObjects(self.src.manage_copyObjects('tree'))
+        self.assertEqual(self._listdir('dst/tree'), ['a.txt', 'link', 'sub'])
+        self.assertEqual(self._read('dst/tree/sub/b.txt'), b'b' * 100000)
+        self.assertEqual(os.readlink(
+            os.path.join(self.dir, 'dst', 'tree', 'link')), 'a.txt')
+        self.assertEqual(self._listdir('dst'), ['tree'])
+
+    def test_copy_name_conflict(self):
+        self._write('src/a.txt', b'new')
+        self._write('dst/a.txt', b'old')
+        cp = self.src.manage_copyObjects('a.txt')
+        self.dst.manage_pasteObjects(cp)
+        self.dst.manage_pasteObjects(cp)
+        self.assertEqual(self._listdir('dst'),
+            ['a.txt', 'copy2_of_a.txt', 'copy_of_a.txt'])
+        self.assertEqual(self._read('dst/a.txt'), b'old')
+        self.assertEqual(self._read('dst/copy_of_a.txt'), b'new')
+
+    def test_copy_into_itself(self):
+        cp = self.fs.manage_copyObjects('src')
+        self.assertRaises(CopyError, self.src.manage_pasteObjects, cp)
+
+    def test_move(self):
+        self._write('src/a.txt', b'data')
+        self.dst.manage_pasteObjects(self.src.manage_cutObjects('a.txt'))
+        self.assertEqual(self._listdir('src'), [])
+        self.assertEqual(self._read('dst/a.txt'), b'data')
+
+    def _exdev(self, src):
+        # os.rename of 'src' fails as if it were on another file system
+        rename = os.rename
+        def _rename(a, b):
+            if a == src:
+                raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+            return rename(a, b)
+        return mock.patch('os.rename', _rename)
+
+    def test_move_file_across_file_systems(self):
+        path = self._write('src/a.txt', b'data')
+        cp = self.src.manage_cutObjects('a.txt')
+        with self._exdev(path):
+            self.dst.manage_pasteObjects(cp)
+        self.assertEqual(self._listdir('src'), [])
+        self.assertEqual(self._listdir('dst'), ['a.txt'])
+        self.assertEqual(self._read('dst/a.txt'), b'data')
+
+    def test_move_tree_across_file_systems(self):
+        os.makedirs(os.path.join(self.dir, 'src', 'tree', 'sub'))
+        self._write('src/tree/sub/b.txt', b'b')
+        cp = self.src.manage_cutObjects('tree')
+        with self._exdev(os.path.join(self.dir, 'src', 'tree')):
+            self.dst.manage_pasteObjects(cp)
+        self.assertEqual(self._listdir('src'), [])
+        self.assertEqual(self._listdir('dst'), ['tree'])
+        self.assertEqual(self._read('dst/tree/sub/b.txt'), b'b')
+
+    def test_failed_copy_leaves_no_files(self):
+        os.makedirs(os.path.join(self.dir, 'src', 'tree'))
+        self._write('src/tree/a.txt', b'a')
+        cp = self.src.manage_copyObjects('tree')
+        with mock.patch('Products.LocalFS.LocalFS._copy_fd',
+                        side_effect=OSError(errno.ENOSPC, 'No space')):
+            self.assertRaises(OSError, self.dst.manage_pasteObjects, cp)
+        self.assertEqual(self._listdir('dst'), [])
@@ -0,0 +1,94 @@
+"""Tests of the metadata index"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from zExceptions import BadRequest
+
+from Products.LocalFS.LocalFS import LocalFS
+
+
+class IndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fs = LocalFS('fs', '', self.dir, '', '')
+        self.fs.index_enabled = 1
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _write(self, name, data=b'', mtime=None):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def _paths(self, **kw):
+        return [r['path'] for r in self.fs.queryFiles(**kw)]
+
+    def test_query(self):
+        os.mkdir(os.path.join(self.dir, 'sub'))
+        self._write('a.txt', b'1', 1000)
+        self._write('b.gif', b'GIF89a', 2000)
+        self._write(os.path.join('sub', 'c.txt'), b'1234567890', 3000)
+        self.assertEqual(self.fs.manage_refreshIndex(), 2)
+        self.assertEqual(self._paths(), ['a.txt', 'b.gif', 'sub',
+            'sub/c.txt'])
+        self.assertEqual(self._paths(name='*.txt'), ['a.txt', 'sub/c.txt'])
+        self.assertEqual(self._paths(type='directory'), ['sub'])
+        self.assertEqual(self._paths(content_type='image/*'), ['b.gif'])
+        self.assertEqual(self._paths(sort_on='size', reverse=1, limit=1),
+            ['sub/c.txt'])
+        row = self.fs.queryFiles(name='c.txt')[0]
+        self.assertEqual((row['name'], row['size'], row['is_dir']),
+            ('c.txt', 10, False))
+        sub = self.fs._getOb('sub')
+        self.assertEqual([r['path'] for r in sub.queryFiles()], ['c.txt'])
+
+    def test_string_parameters(self):
+        self._write('a.txt', b'1', 1000)
+        self._write('b.txt', b'1234567890', 3000)
+        self.fs.manage_refreshIndex()
+        self.assertEqual(self._paths(min_size='5'), ['b.txt'])
+        self.assertEqual(self._paths(max_size='5', min_size=''), ['a.txt'])
+        self.assertEqual(self._paths(newer='2000'), ['b.txt'])
+        self.assertEqual(self._paths(older='2000', newer=''), ['a.txt'])
+        self.assertEqual(self._paths(reverse='0', limit='1'), ['a.txt'])
+        self.assertEqual(self._paths(reverse='1', limit='1'), ['b.txt'])
+        self.assertRaises(BadRequest, self.fs.queryFiles, min_size='x')
+        self.assertRaises(BadRequest, self.fs.queryFiles, limit='x')
+
+    def test_limit_counts_filtered_files(self):
+        # The limit applies to the files that pass the file filter
+        for i in range(5):
+            self._write('hidden%d.bak' % i)
+        self._write('x1.txt')
+        self._write('x2.txt')
+        self.fs.manage_refreshIndex()
+        self.fs.file_filter = '!*.bak'
+        self.assertEqual(self._paths(limit=2), ['x1.txt', 'x2.txt'])
+        self.assertEqual(self._paths(limit=0), [])
+
+    def test_reindex_changed_directory(self):
+        os.mkdir(os.path.join(self.dir, 'sub'))
+        self._write('a.txt', b'1')
+        self._write(os.path.join('sub', 'b.txt'))
+        self.fs.manage_refreshIndex()
+        self.assertEqual(self._paths(), ['a.txt', 'sub', 'sub/b.txt'])
+        self._write('a.txt', b'12345')
+        self._write('new.txt')
+        shutil.rmtree(os.path.join(self.dir, 'sub'))
+        # Until it is refreshed the index is unchanged
+        self.assertEqual(self._paths(), ['a.txt', 'sub', 'sub/b.txt'])
+        self.fs.manage_refreshIndex()
+        self.assertEqual(self._paths(), ['a.txt', 'new.txt'])
+        self.assertEqual(self.fs.queryFiles(name='a.txt')[0]['size'], 5)
+        # Listings bring the index of a changed directory up to date
+        self._write('other.txt')
+        self.assertIn('other.txt', self.fs._indexedMetaTypes())
+        self.assertEqual(self._paths(), ['a.txt', 'new.txt', 'other.txt'])
@@ -0,0 +1,660 @@
+"""Tests of LocalFS directories"""
+
+import glob
+import hashlib
+import json
+import os
+import resource
+import shutil
+import tempfile
+import tracemalloc
+import unittest
+from io import BytesIO
+from unittest import mock
+
+from Acquisition import aq_base
+from DocumentTemplate.DT_HTML import HTML
+from OFS.Image import File, Pdata
+from ZODB.POSException import ConflictError
+from zExceptions import BadRequest
+from zope.globalrequest import setRequest, clearRequest
+
+from Products.LocalFS import LocalFS as LocalFS_module
+from Products.LocalFS.LocalFS import LocalFS, LocalDirectory, LocalFile
+from Products.LocalFS.LocalFS import _cook_ob, _write_atomic, _write_all
+from Products.LocalFS.LocalFS import _guess_content_type, _sniff
+from Products.LocalFS.LocalFS import _sniff_data, _get_dispatch
+from Products.LocalFS.tests.test_publish import makeRequest
+
+
+class LocalFSTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fs = LocalFS('fs', '', self.dir, '', '')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _write(self, name, data=b''):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_objects_keep_no_files_open(self):
+        # Building all objects of a directory with more files than the
+        # open file limit must not run out of file descriptors.
+        for i in range(600):
+            self._write('file%03d.bin' % i, b'data')
+            self._write('image%03d.gif' % i, b'GIF89a\x01\x00\x01\x00')
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (256, hard))
+        try:
+            obs = self.fs._objectValues()
+        finally:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+        self.assertEqual(len(obs), 1200)
+        self.assertEqual(bytes(obs[0].data.data), b'data')
+
+    def test_root_is_not_tested_for_truth(self):
+        # A truth test of a directory looks up __bool__, which would be
+        # looked up as a file of the directory.
+        os.mkdir(os.path.join(self.dir, 'sub'))
+        sub = self.fs._getOb('sub')
+        with mock.patch.object(LocalDirectory, '_getOb') as getOb:
+            self.assertIs(aq_base(self.fs._getRoot()), self.fs)
+            self.assertIs(aq_base(sub._getRoot()), self.fs)
+            self.fs._getCache('object')
+            sub._getCache('object')
+            self.assertFalse(getOb.called)
+
+    def _countLookup(self, ob, id):
+        # Return the number of _getOb and os.stat calls of a lookup
+        getOb, stat = LocalDirectory._getOb, os.stat
+        counts = [0, 0]
+        def _getOb(self, *args):
+            counts[0] += 1
+            return getOb(self, *args)
+        def _stat(*args, **kw):
+            counts[1] += 1
+            return stat(*args, **kw)
+        with mock.patch.object(LocalDirectory, '_getOb', _getOb), \
+                mock.patch('os.stat', _stat):
+            ob._getOb(id, None)
+        return counts
+
+    def test_lookup_calls(self):
+        # A lookup stats the directory and the file, and a name known to
+        # be missing only the directory; truth tests and other names 
+        # starting with '_' are never looked up as files.
+        self._write('a.txt', b'data')
+        self.fs._getOb('a.txt')
+        getOb, stats = self._countLookup(self.fs, 'a.txt')
+        self.assertEqual(getOb, 1)
+        self.assertLessEqual(stats, 4)
+        self.assertEqual(self._countLookup(self.fs, 'missing'), [1, 2])
+        self.assertEqual(self._countLookup(self.fs, 'missing'), [1, 1])
+        with mock.patch.object(LocalDirectory, '_getOb') as getOb:
+            self.assertTrue(self.fs)
+            self.assertRaises(AttributeError, getattr, self.fs, '__bool__')
+            self.assertRaises(AttributeError, getattr, self.fs, '_a.txt')
+            self.assertFalse(getOb.called)
+
+    def test_stats_per_request(self):
+        # Within a request each path is statted once
+        self._write('a.txt', b'data')
+        request, response = makeRequest()
+        setRequest(request)
+        try:
+            self.assertIsNotNone(self.fs.__bobo_traverse__(request, 'a.txt'))
+            self.assertIsNone(self.fs.__bobo_traverse__(request, 'missing'))
+            self.assertIsNotNone(self.fs.__bobo_traverse__(request, 'a.txt'))
+            self.assertIsNone(self.fs.__bobo_traverse__(request, 'missing'))
+        finally:
+            clearRequest()
+        info = request.other['LocalFS_stat_memo'].info()
+        # The directory, a.txt and missing
+        self.assertEqual(info['calls'], 3)
+        self.assertEqual(info['size'], 3)
+
+    def test_object_cache(self):
+        # Compiled objects are built once and copied while their file is
+        # unchanged; a new mtime or a new file rebuilds them.
+        path = self._write('script.py', b'return 1\n')
+        build = mock.patch('Products.LocalFS.LocalFS._build_ob', 
+            wraps=LocalFS_module._build_ob)
+        with build as _build_ob:
+            ob1 = self.fs._getOb('script.py')
+            ob2 = self.fs._getOb('script.py')
+            self.assertEqual(_build_ob.call_count, 1)
+            self.assertIsNot(aq_base(ob1), aq_base(ob2))
+            self.assertIs(aq_base(ob1)._code, aq_base(ob2)._code)
+            st = os.stat(path)
+            os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+            self.fs._getOb('script.py')
+            self.assertEqual(_build_ob.call_count, 2)
+            # A new file with the same mtime
+            tmp = self._write('new.py', b'return 3\n')
+            os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+            os.replace(tmp, path)
+            self.assertIn('return 3', self.fs._getOb('script.py').read())
+            self.assertEqual(_build_ob.call_count, 3)
+        self.assertEqual(self.fs.cacheInfo()['object']['hits'], 1)
+
+    def test_lazy_attributes(self):
+        # The display attributes of listed files are computed when they
+        # are used, once
+        self._write('a.txt', b'12345')
+        self._write('b.gif', b'GIF89a')
+        methods = ('_getType', '_getIcon', '_getTime', '_getDisplaySize', 
+            '_getDisplayTime')
+        patches = [mock.patch.object(LocalFile, name, autospec=True,
+            side_effect=getattr(LocalFile, name)) for name in methods]
+        calls = [p.start() for p in patches]
+        try:
+            files = self.fs.fileValues()
+            self.assertEqual([f.id for f in files], ['a.txt', 'b.gif'])
+            self.assertEqual([c.call_count for c in calls], [0] * 5)
+            self.assertNotIn('display_mtime', files[0].__dict__)
+            display_mtime = files[0].display_mtime
+            self.assertIs(files[0].display_mtime, display_mtime)
+            self.assertEqual(files[0].display_size, '5 bytes')
+            self.assertEqual(files[0].display_size, '5 bytes')
+            counts = dict((n, c.call_count) for n, c in zip(methods, calls))
+            self.assertEqual(counts['_getDisplayTime'], 1)
+            self.assertEqual(counts['_getDisplaySize'], 1)
+            self.assertEqual(counts['_getIcon'], 0)
+            self.assertEqual(files[1].type, 'image/gif')
+            self.assertEqual(files[1].type, 'image/gif')
+            self.assertEqual(calls[0].call_count, 1)
+        finally:
+            for p in patches:
+                p.stop()
+
+    def test_rewritten_file_is_rebuilt(self):
+        # A file rewritten in place does not change its directory, so the
+        # cached listing still has its old stat. The cached object must
+        # be rebuilt all the same.
+        path = self._write('script.py', b'return 1\n')
+        def script():
+            for ob in self.fs._objectValues():
+                if ob.getId() == 'script.py':
+                    return ob
+        self.assertIn('return 1', script().read())
+        mtime = os.stat(path).st_mtime
+        with open(path, 'wb') as f:
+            f.write(b'return 2\n')
+        os.utime(path, (mtime + 10, mtime + 10))
+        self.assertIn('return 2', script().read())
+
+    def test_paging_with_string_parameters(self):
+        # The ZMI and URLs pass reverse, b_start and b_size as strings
+        for name in ('a', 'b', 'c', 'd'):
+            self._write(name)
+        ids = lambda items: [id for id, ob in items]
+        self.assertEqual(ids(self.fs.fileItems(sort_on='id', reverse='0', 
+            b_start='1', b_size='2')), ['b', 'c'])
+        self.assertEqual(ids(self.fs.fileItems(sort_on='id', reverse='1', 
+            b_start='0', b_size='2')), ['d', 'c'])
+        self.assertEqual([ob.id for ob in self.fs.fileValues(reverse='0',
+            b_start='', b_size='')], ['a', 'b', 'c', 'd'])
+
+    def test_contents_view_batch_start(self):
+        # manage_main pages with the b_start request variable
+        self.assertEqual(self.fs.manage_batchStart('20'), 20)
+        self.assertEqual(self.fs.manage_batchStart(''), 0)
+        self.assertEqual(self.fs.manage_batchStart('-5'), 0)
+        self.assertRaises(BadRequest, self.fs.manage_batchStart, 'x')
+        os.mkdir(os.path.join(self.dir, 'sub'))
+        sub = self.fs._getOb('sub')
+        self.assertRaises(BadRequest, sub.manage_batchStart, '1.5')
+
+    def test_listing_json_with_string_parameters(self):
+        for name in ('a', 'b', 'c'):
+            self._write(name)
+        def names(**kw):
+            data = b''.join(self.fs.listing_json(sort_on='id', **kw))
+            return [e['name'] for e in json.loads(data)]
+        self.assertEqual(names(reverse='0'), ['a', 'b', 'c'])
+        self.assertEqual(names(reverse='1', b_start='1', b_size='1'), ['b'])
+
+    def test_tree_skips_listing_of_collapsed_directories(self):
+        # The tree tag only asks collapsed directories whether they have
+        # children, which must not list them.
+        os.makedirs(os.path.join(self.dir, 'a', 'x'))
+        os.makedirs(os.path.join(self.dir, 'b'))
+        for i in range(10):
+            self._write(os.path.join('a', 'file%d' % i))
+        self.fs.tree_view = 1
+        request, response = makeRequest()
+        listed = []
+        items = LocalDirectory._tpItems
+        def _tpItems(ob):
+            listed.append(ob.basepath)
+            return items(ob)
+        with mock.patch.object(LocalDirectory, '_tpItems', _tpItems):
+            html = HTML('<dtml-tree>&dtml-id;</dtml-tree>')(self.fs,
+                {'URL': 'http://localhost/fs', 'REQUEST': request,
+                 'RESPONSE': response})
+        self.assertEqual(listed, [self.dir])
+        self.assertIn('>a</td>', html)
+        self.assertIn('>b</td>', html)
+        self.assertEqual(html.count('Expand...'), 1)
+        self.assertEqual([ob.id for ob in self.fs.tpValues()], ['a', 'b'])
+
+    def test_walk_symlink_loop(self):
+        # A link to an ancestor is listed, but not walked into again
+        os.makedirs(os.path.join(self.dir, 'a', 'b'))
+        self._write(os.path.join('a', 'b', 'file'))
+        os.symlink('..', os.path.join(self.dir, 'a', 'b', 'up'))
+        os.symlink(self.dir, os.path.join(self.dir, 'root'))
+        self.assertEqual(list(self.fs.walk()), [
+            ('', ['a', 'root'], []),
+            ('a', ['b'], []),
+            ('a/b', ['up'], ['file']),
+        ])
+        self.assertEqual(list(self.fs.find(type='file')), ['a/b/file'])
+
+    def test_walk_symlinked_directory(self):
+        # A link to a directory elsewhere in the tree is walked as well as
+        # the directory itself, but links back to the directory that is
+        # being walked (a/x/link/up/d) are not.
+        os.makedirs(os.path.join(self.dir, 'a', 'x'))
+        os.makedirs(os.path.join(self.dir, 'c', 'd'))
+        self._write(os.path.join('c', 'd', 'real.txt'))
+        os.symlink(os.path.join('..', '..', 'c', 'd'), 
+            os.path.join(self.dir, 'a', 'x', 'link'))
+        os.symlink('..', os.path.join(self.dir, 'c', 'd', 'up'))
+        self.assertEqual([rel for rel, dirs, files in self.fs.walk()],
+            ['', 'a', 'a/x', 'a/x/link', 'a/x/link/up', 'c', 'c/d'])
+        self.assertEqual(list(self.fs.find(name='real.txt')), 
+            ['a/x/link/real.txt', 'c/d/real.txt'])
+
+    def test_find_with_string_parameters(self):
+        self._write('small', b'1')
+        self._write('large', b'1234567890')
+        os.utime(os.path.join(self.dir, 'small'), (1000, 1000))
+        self.assertEqual(list(self.fs.find(min_size='5')), ['large'])
+        self.assertEqual(list(self.fs.find(max_size='5', min_size='')), 
+            ['small'])
+        self.assertEqual(list(self.fs.find(newer='2000', type='file')), 
+            ['large'])
+        self.assertEqual(list(self.fs.find(older='1970/01/02 UTC')), 
+            ['small'])
+        self.assertRaises(BadRequest, list, self.fs.find(min_size='x'))
+
+    def test_cook_errors(self):
+        # Template errors are left for rendering, but conflicts and
+        # interrupts are raised.
+        class Template:
+            def __init__(self, error):
+                self.error = error
+            def cook(self):
+                raise self.error
+        _cook_ob(Template(SyntaxError('bad template')))
+        self.assertRaises(ConflictError, _cook_ob, Template(ConflictError()))
+        self.assertRaises(KeyboardInterrupt, _cook_ob, 
+            Template(KeyboardInterrupt()))
+
+    def test_meta_type_conflict(self):
+        # Objects are built to find meta types that are not known from
+        # the type map; conflicts while building them are raised.
+        self._write('script.py', b'return 1\n')
+        e = self.fs._entries(None)[0]
+        path = os.path.join(self.dir, 'script.py')
+        with mock.patch('Products.LocalFS.LocalFS._entry_meta_type',
+                        return_value=None):
+            self.assertEqual(self.fs._entryMetaType(e, path), 
+                'Script (Python)')
+            with mock.patch('Products.LocalFS.LocalFS._create_ob', 
+                            side_effect=ConflictError):
+                self.assertRaises(ConflictError, self.fs._entryMetaType, 
+                    e, path)
+
+    def test_write_atomic_size(self):
+        # Only 'size' bytes of a file object are written, whether they
+        # are copied with copy_file_range or read.
+        src = self._write('src', b'0123456789')
+        path = os.path.join(self.dir, 'dst')
+        def written():
+            with open(path, 'rb') as f:
+                return f.read()
+        with open(src, 'rb') as f:
+            _write_atomic(path, f, size=4)
+        self.assertEqual(written(), b'0123')
+        with open(src, 'rb') as f, mock.patch(
+                'Products.LocalFS.LocalFS._copy_file_range', None):
+            _write_atomic(path, f, size=6)
+        self.assertEqual(written(), b'012345')
+        _write_atomic(path, BytesIO(b'0123456789'), size=3)
+        self.assertEqual(written(), b'012')
+        _write_atomic(path, BytesIO(b'0123456789'))
+        self.assertEqual(written(), b'0123456789')
+
+    def test_put_does_not_build_the_file(self):
+        # PUT replaces an existing file without building its object
+        path = self._write('page.html', b'old')
+        request, response = makeRequest('PUT', b'new data')
+        with mock.patch('Products.LocalFS.LocalFS._create_ob') as create:
+            ob = self.fs.__bobo_traverse__(request, 'page.html')
+            ob.PUT(request, response)
+            self.assertFalse(create.called)
+        self.assertEqual(response.getStatus(), 204)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'new data')
+        request, response = makeRequest('PUT', b'created')
+        self.fs.__bobo_traverse__(request, 'new.html').PUT(request, response)
+        self.assertEqual(response.getStatus(), 201)
+        with open(os.path.join(self.dir, 'new.html'), 'rb') as f:
+            self.assertEqual(f.read(), b'created')
+
+    def _pdataFile(self, id, data, chunk=1 << 16):
+        # File only builds Pdata chains in a database, so link one here
+        ob = File(id, '', b'')
+        next = None
+        for pos in reversed(range(0, len(data), chunk)):
+            pdata = Pdata(data[pos:pos + chunk])
+            pdata.next = next
+            next = pdata
+        ob.update_data(next, size=len(data))
+        return ob
+
+    def test_save_pdata(self):
+        # A File whose data is a chain of Pdata chunks is saved chunk by
+        # chunk, and the file holds exactly its data.
+        data = os.urandom(5 * (1 << 16) + 123)
+        self.fs._setOb('big.bin', self._pdataFile('big.bin', data))
+        with open(os.path.join(self.dir, 'big.bin'), 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_save_large_pdata(self):
+        # The chunks of a long chain are written one at a time; the data
+        # is never joined in memory.
+        chunk = os.urandom(1 << 16)
+        count = 512
+        next = None
+        for i in range(count):
+            pdata = Pdata(chunk)
+            pdata.next = next
+            next = pdata
+        ob = File('big.bin', '', b'')
+        ob.update_data(next, size=len(chunk) * count)
+        sizes = []
+        def write_all(fd, data):
+            sizes.append(len(data))
+            _write_all(fd, data)
+        tracemalloc.start()
+        try:
+            with mock.patch('Products.LocalFS.LocalFS._write_all', 
+                            write_all):
+                self.fs._setOb('big.bin', ob)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(sizes, [len(chunk)] * count)
+        self.assertLess(peak, 8 * len(chunk))
+        md5 = hashlib.md5()
+        with open(os.path.join(self.dir, 'big.bin'), 'rb') as f:
+            for data in iter(lambda: f.read(1 << 20), b''):
+                md5.update(data)
+        self.assertEqual(md5.hexdigest(), 
+            hashlib.md5(chunk * count).hexdigest())
+
+    def test_failed_save_keeps_file(self):
+        # An error after some chunks were written leaves the file as it
+        # was, and no temporary file behind.
+        path = self._write('big.bin', b'original')
+        ob = self._pdataFile('big.bin', os.urandom(3 * (1 << 16)))
+        calls = []
+        def write_all(fd, data):
+            calls.append(len(data))
+            if len(calls) > 1:
+                raise OSError(28, 'No space left on device')
+            _write_all(fd, data)
+        with mock.patch('Products.LocalFS.LocalFS._write_all', write_all):
+            self.assertRaises(OSError, self.fs._setOb, 'big.bin', ob)
+        self.assertEqual(len(calls), 2)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'original')
+        self.assertEqual(os.listdir(self.dir), ['big.bin'])
+
+
+class FileFilterTests(unittest.TestCase):
+
+    files = ('a.txt', 'b.TXT', 'data.bin', 'img1.gif', 'img22.gif', 
+             '.hidden.txt', '.cfg', '_private.txt')
+    dirs = ('sub', 'sub.txt', '.git', 'img3.gif')
+
+    # Include patterns, as matched by glob in earlier versions
+    include = (
+        '*',
+        '*.txt',
+        '*.TXT',
+        '.*',
+        '.* *',
+        '*/',
+        '*/ *.gif',
+        '* */',
+        'sub/',
+        'img?.gif',
+        'img[0-9][0-9].gif',
+        '*.gif img*/',
+        'a.txt data.bin',
+        'nomatch',
+        '*.txt/',
+    )
+
+    # Patterns with exclusions and their expected names. Exclusions
+    # match names starting with a dot as well.
+    exclude = (
+        ('!*.txt', ['.cfg', '.git', 'b.TXT', 'data.bin', 'img1.gif', 
+                    'img22.gif', 'img3.gif', 'sub']),
+        ('!*.txt/', ['.cfg', '.git', '.hidden.txt', 'a.txt', 'b.TXT', 
+                     'data.bin', 'img1.gif', 'img22.gif', 'img3.gif', 
+                     'sub']),
+        ('!.*', ['a.txt', 'b.TXT', 'data.bin', 'img1.gif', 'img22.gif', 
+                 'img3.gif', 'sub', 'sub.txt']),
+        ('*.gif !img2*', ['img1.gif', 'img3.gif']),
+        ('*.gif !img3.gif/', ['img1.gif', 'img22.gif']),
+        ('*/ !sub*', ['.git', 'img3.gif']),
+        ('!*/', ['.cfg', '.hidden.txt', 'a.txt', 'b.TXT', 'data.bin', 
+                 'img1.gif', 'img22.gif']),
+    )
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        for name in self.files:
+            open(os.path.join(self.dir, name), 'wb').close()
+        for name in self.dirs:
+            os.mkdir(os.path.join(self.dir, name))
+        self.fs = LocalFS('fs', '', self.dir, '', '')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _glob(self, spec):
+        # The names listed by earlier versions, which ran glob in the 
+        # directory and added all directories for a '*/' pattern
+        spec = spec.split()
+        names = set()
+        if '*/' in spec:
+            names.update(self.dirs)
+        for pattern in spec:
+            for name in glob.glob(pattern, root_dir=self.dir):
+                names.add(name.rstrip(os.sep))
+        return sorted(name for name in names if name[:1] != '_')
+
+    def test_include_patterns(self):
+        for spec in self.include:
+            self.assertEqual(self.fs.fileIds(spec), self._glob(spec), spec)
+
+    def test_exclude_patterns(self):
+        for spec, names in self.exclude:
+            self.assertEqual(self.fs.fileIds(spec), names, spec)
+
+    def test_file_filter_property(self):
+        self.fs.file_filter = '*.gif'
+        self.assertEqual(self.fs.fileIds(), 
+            ['img1.gif', 'img22.gif', 'img3.gif'])
+        self.assertEqual(len(self.fs.fileIds('*')), 8)
+        self.fs.file_filter = None
+        self.assertEqual(len(self.fs.fileIds()), 11)
+
+
+class SniffTests(unittest.TestCase):
+
+    signatures = (
+        (b'\x89PNG\r\n\x1a\n\x00\x00', 'image/png'),
+        (b'\xff\xd8\xff\xe0\x00\x10JFIF', 'image/jpeg'),
+        (b'GIF89a\x01\x00', 'image/gif'),
+        (b'%PDF-1.4\n', 'application/pdf'),
+        (b'PK\x03\x04\x14\x00', 'application/zip'),
+        (b'\x1f\x8b\x08\x00', 'application/x-gzip'),
+        (b'RIFF\x00\x00\x00\x00WAVEfmt ', 'audio/x-wav'),
+        (b'RIFF\x00\x00\x00\x00WEBPVP8 ', 'image/webp'),
+        (b'\x00\x00\x00\x18ftypmp42', 'video/mp4'),
+        (b'\x00' * 257 + b'ustar\x0000', 'application/x-tar'),
+        (b'<!DOCTYPE html><html>', 'text/html'),
+        (b'\xef\xbb\xbf  <html lang="en">', 'text/html'),
+        (b'<?xml version="1.0"?><a/>', 'text/xml'),
+        (b'Plain text\r\n\tand more', 'text/plain'),
+        (b'caf\xc3\xa9', 'text/plain'),
+        (b'\x00\x01\x02\x03', 'application/octet-stream'),
+        (b'', 'text/plain'),
+    )
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fs = LocalFS('fs', '', self.dir, '', '')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _write(self, name, data):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_signatures(self):
+        for data, content_type in self.signatures:
+            self.assertEqual(_sniff_data(data), content_type, data)
+
+    def test_sniffed_once(self):
+        # A file is read once until it changes
+        path = self._write('noext', b'%PDF-1.4\n')
+        read = os.read
+        with mock.patch('os.read', side_effect=read) as os_read:
+            self.assertEqual(_sniff(path), 'application/pdf')
+            self.assertEqual(_sniff(path), 'application/pdf')
+            self.assertEqual(os_read.call_count, 1)
+            tmp = self._write('tmp', b'GIF89a')
+            os.replace(tmp, path)
+            self.assertEqual(_sniff(path), 'image/gif')
+            self.assertEqual(os_read.call_count, 2)
+
+    def test_guess_content_type(self):
+        # Files named like HTML files are text unless they look like HTML
+        path = self._write('notes.html', b'Just text')
+        self.assertEqual(_guess_content_type('notes.html', path),
+            'text/plain')
+        path = self._write('page.html', b'<html><body></body></html>')
+        self.assertEqual(_guess_content_type('page.html', path),
+            'text/html')
+        path = self._write('data.json', b'\x00\x01')
+        self.assertEqual(_guess_content_type('data.json', path),
+            'application/json')
+
+    def test_objects(self):
+        # Files without an extension are typed from their content
+        self._write('image', b'\x89PNG\r\n\x1a\n')
+        self._write('archive', b'PK\x03\x04')
+        self.assertEqual(self.fs._getOb('image').content_type, 'image/png')
+        self.assertEqual(self.fs._getOb('archive').content_type,
+            'application/zip')
+        types = dict((ob.id, ob.type) for ob in self.fs.fileValues())
+        self.assertEqual(types, {'image': 'image/png',
+            'archive': 'application/zip'})
+
+
+class DispatchTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fs = LocalFS('fs', '', self.dir, '', '')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _write(self, name, data=b''):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_dispatch_table(self):
+        table = _get_dispatch(self.fs._type_map)
+        self.assertIs(_get_dispatch(self.fs._type_map), table)
+        t, c, create, meta_type = table['.gif']
+        self.assertEqual((t, c, meta_type), ('image/gif', 'Image', 'Image'))
+        self.assertTrue(callable(create))
+        self.assertEqual(table['.py'][3], 'Script (Python)')
+        self.assertEqual(table['.ra'], 
+            ('audio/vnd.rn-realaudio', '', None, 'File'))
+        # Factories give the meta type when they have built an object
+        self.assertEqual(table['.xml'][3], None)
+        # A new type map gets a new table
+        self.fs._type_map = LocalFS_module._list2typemap(
+            ['.gif image/gif File'])
+        table = _get_dispatch(self.fs._type_map)
+        self.assertEqual(list(table), ['.gif'])
+        self.assertEqual(table['.gif'][3], 'File')
+
+    def test_unresolvable_class(self):
+        # Files of a class that cannot be imported are File objects, and
+        # the class is reported once per type map
+        type_map = {'.a': ('text/plain', 'no_such_module.NoClass'),
+                    '.b': ('text/plain', 'no_such_module.NoClass')}
+        with mock.patch.object(LocalFS_module.LOG, 'warning') as warning:
+            table = _get_dispatch(type_map)
+            _get_dispatch(type_map)
+        self.assertEqual(warning.call_count, 1)
+        self.assertEqual(table['.a'], 
+            ('text/plain', 'no_such_module.NoClass', None, 'File'))
+        self.fs._type_map = type_map
+        self._write('x.a', b'text')
+        ob = self.fs._getOb('x.a')
+        self.assertEqual((ob.meta_type, ob.content_type), 
+            ('File', 'text/plain'))
+
+    def test_meta_types_from_type_map(self):
+        self._write('a.gif', b'GIF89a')
+        self._write('b.py', b'return 1\n')
+        self._write('c.txt', b'text')
+        self._write('d.GIF', b'GIF89a')
+        os.mkdir(os.path.join(self.dir, 'sub'))
+        e = dict((e.name, e) for e in self.fs._entries(None))
+        meta_types = dict((name, LocalFS_module._entry_meta_type(
+            e[name], self.fs._type_map)) for name in e)
+        self.assertEqual(meta_types, {'a.gif': 'Image', 
+            'b.py': 'Script (Python)', 'c.txt': 'File', 'd.GIF': 'Image',
+            'sub': 'Local Directory'})
+
+    def test_listing_by_meta_type(self):
+        # Only the objects of the requested meta types are built, once
+        self._write('a.gif', b'GIF89a')
+        self._write('b.py', b'return 1\n')
+        self._write('c.txt', b'text')
+        self._write('d.gif', b'GIF89a')
+        build = mock.patch('Products.LocalFS.LocalFS._build_ob',
+            side_effect=LocalFS_module._build_ob)
+        with build as _build_ob:
+            self.assertEqual(sorted(self.fs._objectIds(['Image', 'File'])),
+                ['a.gif', 'c.txt', 'd.gif'])
+            self.assertEqual(_build_ob.call_count, 0)
+            obs = self.fs._objectValues('Image')
+            self.assertEqual(sorted(ob.getId() for ob in obs), 
+                ['a.gif', 'd.gif'])
+            self.assertEqual(sorted(c[0][0] for c in _build_ob.call_args_list),
+                ['a.gif', 'd.gif'])
@@ -0,0 +1,48 @@
+"""Tests of the streaming File and Image classes"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from Products.LocalFS.StreamingFile import StreamingFile, Sdata, BUFFER_SIZE
+
+
+class StreamingFileTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'data.bin')
+        self.data = os.urandom(3 * BUFFER_SIZE + 17)
+        with open(self.path, 'wb') as f:
+            f.write(self.data)
+        self.file = None
+
+    def tearDown(self):
+        if self.file is not None:
+            self.file.close()
+        shutil.rmtree(self.dir)
+
+    def _makeOne(self):
+        self.file = open(self.path, 'rb')
+        return StreamingFile('data.bin', '', self.file)
+
+    def test_data_is_streamed(self):
+        ob = self._makeOne()
+        self.assertIsInstance(ob.data, Sdata)
+        self.assertEqual(ob.size, len(self.data))
+        chunks = []
+        data = ob.data
+        while data is not None:
+            chunks.append(bytes(data.data))
+            data = data.next
+        self.assertEqual(b''.join(chunks), self.data)
+
+    def test_truncated_file(self):
+        # A file truncated by another process reads short, it must not
+        # crash the process (as a memory map would with SIGBUS).
+        ob = self._makeOne()
+        with open(self.path, 'r+b') as f:
+            f.truncate(10)
+        self.assertEqual(bytes(ob.data.data), self.data[:10])
+        self.assertEqual(bytes(ob.data.next.data), b'')
@@ -0,0 +1,138 @@
+"""Tests of chunked uploads"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from zExceptions import BadRequest
+
+from Products.LocalFS.LocalFS import LocalFS
+from Products.LocalFS.Upload import Staging, StagingError
+from Products.LocalFS.tests.test_publish import makeRequest
+
+
+class StagingTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.staging = Staging(os.path.join(self.dir, '_uploads'))
+        self.target = os.path.join(self.dir, 'file.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_checksum_algorithms(self):
+        digest = hashlib.sha256(b'').hexdigest()
+        self.staging.start(self.target, checksum='sha256:' + digest)
+        self.staging.start(self.target, checksum='SHA256:' + digest)
+        for checksum in ('sha256', 'sha256:abc', 'nohash:' + digest,
+                         'shake_128:' + digest, 'shake_256:', 'shake_256:0'):
+            self.assertRaises(StagingError, self.staging.start,
+                self.target, checksum=checksum)
+
+    def test_resume(self):
+        data = os.urandom(1000)
+        checksum = 'sha1:' + hashlib.sha1(data).hexdigest()
+        token = self.staging.start(self.target, len(data), checksum)
+        self.assertEqual(self.staging.append(token, 0, data[:600]), 600)
+        # The chunk after 400 is sent again after an interruption
+        self.assertEqual(self.staging.append(token, 400, data[400:700]), 700)
+        self.assertEqual(self.staging.offset(token), 700)
+        # A new Staging does not have the hash state in memory
+        staging = Staging(self.staging.path)
+        self.assertEqual(staging.append(token, 700, data[700:]), 1000)
+        self.assertRaises(StagingError, staging.append, token, 1001, b'x')
+        part, settings = staging.finish(token)
+        self.assertEqual(self._read(part), data)
+        self.assertEqual(settings['target'], self.target)
+        staging.remove(token)
+        self.assertFalse(staging.exists(token))
+
+    def test_checksum_mismatch(self):
+        checksum = 'md5:' + hashlib.md5(b'other').hexdigest()
+        token = self.staging.start(self.target, checksum=checksum)
+        self.staging.append(token, 0, b'data')
+        self.assertRaises(StagingError, self.staging.finish, token)
+
+    def test_incomplete(self):
+        token = self.staging.start(self.target, 10)
+        self.staging.append(token, 0, b'12345')
+        self.assertRaises(StagingError, self.staging.finish, token)
+        self.assertRaises(StagingError, self.staging.append, token, 5,
+            b'1234567')
+
+    def test_collect(self):
+        old = self.staging.start(self.target)
+        new = self.staging.start(self.target + '2')
+        t = time.time() - 100
+        for path in self.staging._paths(old):
+            os.utime(path, (t, t))
+        self.staging.collect(50)
+        self.assertFalse(self.staging.exists(old))
+        self.assertTrue(self.staging.exists(new))
+        self.staging.collect(0)
+        self.assertTrue(self.staging.exists(new))
+
+
+class UploadTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fs = LocalFS('fs', '', self.dir, '', '')
+        self.path = os.path.join(self.dir, 'file.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _put(self, body, content_range):
+        request, response = makeRequest('PUT', body,
+            content_range=content_range)
+        ob = self.fs.__bobo_traverse__(request, 'file.bin')
+        ob.PUT(request, response)
+        return response
+
+    def test_content_range(self):
+        data = b'0123456789'
+        response = self._put(data[:4], 'bytes 0-3/10')
+        self.assertEqual(response.getStatus(), 308)
+        self.assertEqual(response.getHeader('Range'), 'bytes=0-3')
+        self.assertFalse(os.path.exists(self.path))
+        # The client asks for the range received so far
+        response = self._put(b'', 'bytes */10')
+        self.assertEqual(response.getStatus(), 308)
+        self.assertEqual(response.getHeader('Range'), 'bytes=0-3')
+        response = self._put(data[4:], 'bytes 4-9/10')
+        self.assertEqual(response.getStatus(), 201)
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), data)
+        self.assertRaises(BadRequest, self._put, b'12', 'bytes 5-3/10')
+        self.assertRaises(BadRequest, self._put, b'12', 'bytes 0-2/10')
+
+    def test_chunked_upload(self):
+        data = os.urandom(3000)
+        checksum = 'sha256:' + hashlib.sha256(data).hexdigest()
+        token = self.fs.manage_uploadStart('file.bin', '3000', checksum)
+        self.assertEqual(self.fs.manage_uploadChunk(token, '0', data[:1000]),
+            1000)
+        self.assertEqual(self.fs.manage_uploadStatus(token), 1000)
+        self.fs.manage_uploadChunk(token, 1000, data[1000:])
+        self.assertEqual(self.fs.manage_uploadFinish(token), 'file.bin')
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), data)
+        self.assertRaises(BadRequest, self.fs.manage_uploadStatus, token)
+
+    def test_checksum_mismatch(self):
+        checksum = 'sha256:' + hashlib.sha256(b'other').hexdigest()
+        token = self.fs.manage_uploadStart('file.bin', checksum=checksum)
+        self.fs.manage_uploadChunk(token, 0, b'data')
+        self.assertRaises(BadRequest, self.fs.manage_uploadFinish, token)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertRaises(BadRequest, self.fs.manage_uploadStart,
+            'file.bin', checksum='shake_256:' + 'ab' * 32)
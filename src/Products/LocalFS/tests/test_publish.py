@@ -0,0 +1,223 @@
+"""Tests of publishing local files through the response"""
+
+import os
+import resource
+import shutil
+import tempfile
+import unittest
+from io import BytesIO
+from unittest import mock
+
+from ZPublisher.HTTPRequest import HTTPRequest
+from ZPublisher.HTTPResponse import WSGIResponse
+
+from Products.LocalFS.LocalFS import LocalFS, LocalFileStat
+
+
+def makeRequest(method='GET', body=None, **headers):
+    environ = {
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'REQUEST_METHOD': method,
+    }
+    for name, value in headers.items():
+        environ['HTTP_' + name.upper()] = value
+    if body is not None:
+        environ['CONTENT_LENGTH'] = str(len(body))
+        environ['CONTENT_TYPE'] = 'application/octet-stream'
+    response = WSGIResponse()
+    request = HTTPRequest(BytesIO(body or b''), environ, response)
+    if body is not None:
+        request.processInputs()
+    return request, response
+
+def publish(ob, **headers):
+    """Publish the index_html of 'ob' and return the response and the body
+    as the server would send it."""
+    request, response = makeRequest(**headers)
+    response.setBody(ob.index_html(request, response))
+    body = response.body
+    if hasattr(body, 'read'):
+        try:
+            length = int(response.getHeader('Content-Length'))
+            data = body.read(length)
+        finally:
+            body.close()
+    elif isinstance(body, bytes):
+        data = body
+    else:
+        data = b''.join(body)
+    return response, data
+
+
+class PublishTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.data = bytes(range(100))
+        self._write('data.bin', self.data)
+        self.fs = LocalFS('fs', '', self.dir, '', '')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _write(self, name, data):
+        with open(os.path.join(self.dir, name), 'wb') as f:
+            f.write(data)
+
+    def test_whole_file(self):
+        ob = self.fs._getOb('data.bin')
+        response, body = publish(ob)
+        self.assertEqual(response.getStatus(), 200)
+        self.assertEqual(response.getHeader('Content-Length'), '100')
+        self.assertEqual(body, self.data)
+
+    def test_replaced_file(self):
+        # The file is replaced after the object was built: the headers
+        # and the body both describe the new file.
+        ob = self.fs._getOb('data.bin')
+        new = b'new data'
+        tmp = os.path.join(self.dir, 'tmp')
+        with open(tmp, 'wb') as f:
+            f.write(new)
+        os.replace(tmp, os.path.join(self.dir, 'data.bin'))
+        st = os.stat(os.path.join(self.dir, 'data.bin'))
+        response, body = publish(ob)
+        self.assertEqual(response.getHeader('Content-Length'), str(len(new)))
+        self.assertIn('%x-' % st.st_ino, response.getHeader('ETag'))
+        self.assertEqual(body, new)
+
+    def test_single_range(self):
+        # WSGIResponse.setBody sends file objects as a whole, so a range
+        # must be published as a stream iterator that is not a file.
+        ob = self.fs._getOb('data.bin')
+        fds = len(os.listdir('/proc/self/fd'))
+        response, body = publish(ob, range='bytes=50-59')
+        self.assertFalse(hasattr(response.body, 'read'))
+        self.assertEqual(len(os.listdir('/proc/self/fd')), fds)
+        self.assertEqual(response.getStatus(), 206)
+        self.assertEqual(response.getHeader('Content-Length'), '10')
+        self.assertEqual(response.getHeader('Content-Range'), 
+            'bytes 50-59/100')
+        self.assertEqual(body, self.data[50:60])
+
+    def test_multiple_ranges(self):
+        ob = self.fs._getOb('data.bin')
+        response, body = publish(ob, range='bytes=0-1,98-')
+        self.assertEqual(response.getStatus(), 206)
+        self.assertEqual(response.getHeader('Content-Length'), 
+            str(len(body)))
+        self.assertIn(self.data[0:2], body)
+        self.assertIn(self.data[98:], body)
+
+    def test_unsatisfiable_range(self):
+        ob = self.fs._getOb('data.bin')
+        response, body = publish(ob, range='bytes=200-300')
+        self.assertEqual(response.getStatus(), 416)
+        self.assertEqual(body, b'')
+
+
+class StatTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.data = b'GIF89a' + bytes(range(100))
+        self._write('image.gif', self.data)
+        self.fs = LocalFS('fs', '', self.dir, '', '')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _write(self, name, data):
+        with open(os.path.join(self.dir, name), 'wb') as f:
+            f.write(data)
+
+    def _traverse(self, name, method='GET', **headers):
+        request, response = makeRequest(method, **headers)
+        ob = self.fs.__bobo_traverse__(request, name)
+        if method == 'HEAD':
+            ob.HEAD(request, response)
+        else:
+            response.setBody(ob.index_html(request, response))
+        return ob, response
+
+    def test_head(self):
+        # HEAD requests are answered from the stat data of the file,
+        # with the headers of a GET request
+        build = mock.patch('Products.LocalFS.LocalFS._build_ob')
+        with build as _build_ob:
+            ob, head = self._traverse('image.gif', 'HEAD')
+            self.assertEqual(_build_ob.call_count, 0)
+        self.assertIsInstance(ob, LocalFileStat)
+        response, body = publish(self.fs._getOb('image.gif'))
+        self.assertEqual(head.getStatus(), 200)
+        for name in ('Content-Type', 'Content-Length', 'ETag', 
+                     'Last-Modified'):
+            self.assertEqual(head.getHeader(name), response.getHeader(name))
+        ob, head = self._traverse('image.gif', 'HEAD', 
+            if_none_match=response.getHeader('ETag'))
+        self.assertEqual(head.getStatus(), 304)
+
+    def test_conditional_get(self):
+        response, body = publish(self.fs._getOb('image.gif'))
+        etag = response.getHeader('ETag')
+        ob, response = self._traverse('image.gif', if_none_match=etag)
+        self.assertIsInstance(ob, LocalFileStat)
+        self.assertEqual(response.getStatus(), 304)
+        self.assertEqual(response.getHeader('ETag'), etag)
+        # A changed file is published as a whole
+        self._write('image.gif', self.data + b'more')
+        ob, response = self._traverse('image.gif', if_none_match=etag)
+        self.assertNotIsInstance(ob, LocalFileStat)
+        self.assertEqual(response.getStatus(), 200)
+        # Objects that are not published as they are have no stat data
+        self._write('script.py', b'return 1\n')
+        request, response = makeRequest('HEAD')
+        self.assertNotIsInstance(
+            self.fs.__bobo_traverse__(request, 'script.py'), LocalFileStat)
+
+    def test_upper_case_extension(self):
+        # The type map is used for upper case extensions in listings as 
+        # well as in HEAD and GET requests
+        self._write('SONG.RA', b'.ra\xfd')
+        ob, head = self._traverse('SONG.RA', 'HEAD')
+        response, body = publish(self.fs._getOb('SONG.RA'))
+        types = dict((f.id, f.type) for f in self.fs.fileValues())
+        self.assertEqual(head.getHeader('Content-Type'), 
+            'audio/vnd.rn-realaudio')
+        self.assertEqual(response.getHeader('Content-Type'), 
+            'audio/vnd.rn-realaudio')
+        self.assertEqual(types['SONG.RA'], 'audio/vnd.rn-realaudio')
+
+
+class LargeFileTests(unittest.TestCase):
+
+    size = 3 << 30
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        with open(os.path.join(self.dir, 'large.iso'), 'wb') as f:
+            f.truncate(self.size)
+        self.fs = LocalFS('fs', '', self.dir, '', '')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_bounded_memory(self):
+        # A sparse file of several GB is served without loading it
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        ob = self.fs._getOb('large.iso')
+        request, response = makeRequest()
+        response.setBody(ob.index_html(request, response))
+        self.assertEqual(response.getHeader('Content-Length'), 
+            str(self.size))
+        body = response.body
+        sent = 0
+        try:
+            for chunk in body:
+                sent += len(chunk)
+        finally:
+            body.close()
+        self.assertEqual(sent, self.size)
+        grown = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss
+        self.assertLess(grown * 1024, 64 << 20)